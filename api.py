@@ -0,0 +1,97 @@
+import json
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from wishes import Wish
+
+# Number of wishes encoded into one chunk when streaming
+JSON_CHUNK_SIZE = 200
+
+
+class Viewer(NamedTuple):
+    """Who wishes are serialized for, decides what of them is shown."""
+
+    giftedWishSecrets: frozenset
+    noSpoiler: bool
+    isAdmin: bool
+
+
+def _isMine(wish: Wish, viewer: Viewer):
+    return wish.secret is not None and wish.secret in viewer.giftedWishSecrets
+
+
+def _showsFulfilled(wish: Wish, viewer: Viewer):
+    """Same rule as the list page: without spoilers, only your own gifts are shown."""
+    return not viewer.noSpoiler or _isMine(wish, viewer)
+
+
+# Fields visitors can select, and how to get each one from a wish
+VISITOR_FIELDS: dict[str, Callable[[Wish, Viewer], object]] = {
+    "id": lambda wish, viewer: wish.id,
+    "title": lambda wish, viewer: wish.title,
+    "priority": lambda wish, viewer: wish.priority,
+    "desc": lambda wish, viewer: wish.desc,
+    "link": lambda wish, viewer: wish.link,
+    "linkDomain": lambda wish, viewer: wish.getLinkDomain() if wish.link else "",
+    "endless": lambda wish, viewer: wish.endless,
+    # None if the viewer doesn't want to know
+    "fulfilled": lambda wish, viewer: (
+        wish.isFulfilled() if _showsFulfilled(wish, viewer) else None
+    ),
+    "isMine": _isMine,
+    # Only for the visitor who fulfilled the wish, to reopen it with
+    "secret": lambda wish, viewer: wish.secret if _isMine(wish, viewer) else None,
+}
+ADMIN_FIELDS = VISITOR_FIELDS | {
+    "giver": lambda wish, viewer: wish.giver if _showsFulfilled(wish, viewer) else None,
+    "deleted": lambda wish, viewer: wish.deleted.isoformat() if wish.deleted else None,
+}
+
+
+def selectFields(requested: str | None, isAdmin: bool):
+    """
+    Args:
+        requested (str, optional): comma separated field names, None or empty for all fields
+        isAdmin (bool): whether the admin only fields can be selected
+
+    Raises:
+        ValueError: Is raised if a field doesn't exist or may not be selected.
+
+    Returns:
+        the selected field names with the function getting each one
+    """
+    available = ADMIN_FIELDS if isAdmin else VISITOR_FIELDS
+    if not requested:
+        return tuple(available.items())
+    names = dict.fromkeys(name.strip() for name in requested.split(",") if name.strip())
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unbekannte Felder: {', '.join(unknown)}")
+    return tuple((name, available[name]) for name in names)
+
+
+def toJsonable(wish: Wish, fields: tuple, viewer: Viewer):
+    return {name: getField(wish, viewer) for name, getField in fields}
+
+
+def writeJson(wishes: Iterable[Wish], fields: tuple, viewer: Viewer) -> Iterator[str]:
+    """
+    Encode wishes as a compact JSON object with a "wishes" list, in chunks,
+    so long lists don't have to be held in memory as a whole.
+
+    Yields:
+        the JSON document in pieces
+    """
+    yield '{"wishes":['
+    batch = []
+    first = True
+    for wish in wishes:
+        batch.append(
+            json.dumps(toJsonable(wish, fields, viewer), ensure_ascii=False, separators=(",", ":"))
+        )
+        if len(batch) >= JSON_CHUNK_SIZE:
+            yield ("" if first else ",") + ",".join(batch)
+            batch = []
+            first = False
+    if batch:
+        yield ("" if first else ",") + ",".join(batch)
+    yield "]}"
@@ -1,223 +1,698 @@
 from datetime import timedelta
+from hashlib import sha256
+from io import TextIOWrapper
 import os
 import warnings
 import secrets
 
 from utils import *
+from assets import AssetStore
+from backups import BackupError, Backups
+from cache import RenderCache
+from maintenance import Maintenance, Scheduler
+from metrics import Metrics
+from snapshots import VIEW_DYNAMIC, VIEW_SNAPSHOT, SnapshotPublisher, viewCookieName
+from tenants import (
+    DEFAULT_LIST,
+    LIST_ENVIRON_KEY,
+    ListDispatcher,
+    ListSessionInterface,
+    addMissingListSecrets,
+    currentListSlug,
+    defaultListOnly,
+    loadListConfigs,
+)
+from transfer import FORMATS, READERS, WRITERS
+from api import Viewer, selectFields, writeJson
+from database import configureSqlite, db, migrate
+from wishes import (
+    Wishlist,
+    WishView,
+    BatchOperationError,
+    ChangesExpiredError,
+    SecretMismatchError,
+    WishEndlessError,
+    WishFulfilledError,
+    WishNotFoundError,
+)
+from changes import ChangeFeed
 
 from flask import (
     Flask,
+    Response,
+    abort,
+    current_app,
+    jsonify,
     render_template,
     request,
     redirect,
+    stream_with_context,
     url_for,
     session,
 )
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from werkzeug.local import LocalProxy
+from markupsafe import Markup
 import tomllib
 import tomli_w
 
-configFilePath = os.path.join(os.path.dirname(__file__), "config/config.toml")
-
-try:
-    with open(configFilePath, "rb") as f:
-        configFileContents = tomllib.load(f)
-except FileNotFoundError:
-    configFileContents = {}
-
-writeConfig = False
-
-if not configFileContents.get("ADMIN_SECRET"):
-    configFileContents["ADMIN_SECRET"] = secrets.token_hex()
-    writeConfig = True
+CONFIG_FILE_PATH = os.path.join(os.path.dirname(__file__), "config/config.toml")
+
+# Views collected by @route, added to every app create_app makes
+ROUTES = []
+
+
+class AppState:
+    def __init__(
+        self,
+        listConfigs: dict,
+        wishlists: dict,
+        renderCache: RenderCache,
+        fragmentCache: RenderCache,
+        metrics: Metrics,
+        changeFeed: ChangeFeed,
+        assets: AssetStore,
+        snapshots: SnapshotPublisher | None,
+        scheduler: Scheduler,
+        maintenance: Maintenance,
+        backups: Backups | None,
+        configFilePath: str | None,
+        fingerprint: str,
+    ):
+        """
+        Everything create_app sets up for an app, kept in app.extensions["wishlist"].
+
+        Args:
+            listConfigs (dict): settings of all lists by slug
+            wishlists (dict): the Wishlist of every list by slug
+            renderCache (RenderCache): cache for whole pages
+            fragmentCache (RenderCache): cache for single rendered wishes
+            metrics (Metrics): the app's metrics
+            changeFeed (ChangeFeed): changes to the app's wishlists
+            assets (AssetStore): the static files and theme stylesheets
+            snapshots (SnapshotPublisher, optional): publisher of the list pages, if SNAPSHOT_DIR is set
+            scheduler (Scheduler): runs the background jobs
+            maintenance (Maintenance): the database maintenance job
+            backups (Backups, optional): the database backups, if BACKUP_DIR is set and the database is a SQLite file
+            configFilePath (str, optional): the config file the app was created from, if any
+            fingerprint (str): hash of the templates, assets and list settings, see appFingerprint
+        """
+        self.listConfigs = listConfigs
+        self.wishlists = wishlists
+        self.renderCache = renderCache
+        self.fragmentCache = fragmentCache
+        self.metrics = metrics
+        self.changeFeed = changeFeed
+        self.assets = assets
+        self.snapshots = snapshots
+        self.scheduler = scheduler
+        self.maintenance = maintenance
+        self.backups = backups
+        self.configFilePath = configFilePath
+        self.fingerprint = fingerprint
+
+
+def _state():
+    return current_app.extensions["wishlist"]
+
+
+# The list and its settings for the current request, and the current app's caches
+wishlist = LocalProxy(lambda: _state().wishlists[currentListSlug()])
+listConfig = LocalProxy(lambda: _state().listConfigs[currentListSlug()])
+renderCache = LocalProxy(lambda: _state().renderCache)
+fragmentCache = LocalProxy(lambda: _state().fragmentCache)
+metrics = LocalProxy(lambda: _state().metrics)
+changeFeed = LocalProxy(lambda: _state().changeFeed)
+assets = LocalProxy(lambda: _state().assets)
+
+
+def readConfigFile(configFilePath: str):
+    try:
+        with open(configFilePath, "rb") as f:
+            return tomllib.load(f)
+    except FileNotFoundError:
+        return {}
 
-if not configFileContents.get("SECRET_KEY"):
-    configFileContents["SECRET_KEY"] = secrets.token_hex()
-    writeConfig = True
 
-if writeConfig:
+def writeConfigFile(configFilePath: str, configFileContents: dict):
     os.makedirs(os.path.dirname(configFilePath), exist_ok=True)
     with open(configFilePath, "wb") as f:
         tomli_w.dump(configFileContents, f)
 
 
-app = Flask(__name__)
-app.config.from_mapping(configFileContents)
-setDefaultConfigValues(app)
+def loadConfigFile(configFilePath: str):
+    """
+    Read config.toml, generating and saving the secrets that are missing.
 
-# We force a value here to make sure sessions persist when wishes are fulfilled
-if app.config.get("PERMANENT_SESSION_LIFETIME"):
-    warnings.warn(
-        "Ignored setting PERMANENT_SESSION_LIFETIME, this value is not configurable.",
-        RuntimeWarning,
-    )
-app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(weeks=52 * 4)
+    Args:
+        configFilePath (str): path of config.toml
+
+    Returns:
+        dict of the config values
+    """
+    configFileContents = readConfigFile(configFilePath)
+    writeConfig = False
+
+    if not configFileContents.get("ADMIN_SECRET"):
+        configFileContents["ADMIN_SECRET"] = secrets.token_hex()
+        writeConfig = True
+
+    if not configFileContents.get("SECRET_KEY"):
+        configFileContents["SECRET_KEY"] = secrets.token_hex()
+        writeConfig = True
+
+    if addMissingListSecrets(configFileContents):
+        writeConfig = True
 
+    if writeConfig:
+        writeConfigFile(configFilePath, configFileContents)
+    return configFileContents
 
-class Base(DeclarativeBase):
-    pass
 
+def route(rule: str, **options):
+    """
+    Like app.route, but only collects the view. create_app adds all of them to its app.
+    """
 
-db = SQLAlchemy(model_class=Base)
-db.init_app(app)
+    def routeDecorator(f: Callable):
+        ROUTES.append((rule, f, options))
+        return f
 
-from wishes import Wishlist, SecretMismatchError, WishFulfilledError, WishNotFoundError
+    return routeDecorator
 
-with app.app_context():
-    db.create_all()
 
-wishlist = Wishlist()
+def create_app(config: dict | None = None):
+    """
+    Create and set up the app. Importing this module does neither, so WSGI
+    servers can import it in a master process and fork workers from there,
+    and tests can create isolated apps with an in-memory database.
+
+    Args:
+        config (dict, optional): config values to use instead of config/config.toml and
+            WISHLIST_ environment variables. Missing secrets are generated. Defaults to None.
+
+    Returns:
+        the app
+    """
+    app = Flask(__name__)
+    if config is None:
+        configFilePath = CONFIG_FILE_PATH
+        config = loadConfigFile(configFilePath)
+        app.config.from_mapping(config)
+        # e.g. WISHLIST_SQLALCHEMY_DATABASE_URI overrides SQLALCHEMY_DATABASE_URI
+        app.config.from_prefixed_env("WISHLIST")
+    else:
+        configFilePath = None
+        app.config.from_mapping(config)
+        for key in ("ADMIN_SECRET", "SECRET_KEY"):
+            if not app.config.get(key):
+                app.config[key] = secrets.token_hex()
+    setDefaultConfigValues(app)
+    # Assets are the same for everyone, a session cookie would keep proxies from caching them
+    app.session_interface = ListSessionInterface(sessionlessEndpoints={"assetView"})
+
+    # We force a value here to make sure sessions persist when wishes are fulfilled
+    if "PERMANENT_SESSION_LIFETIME" in config:
+        warnings.warn(
+            "Ignored setting PERMANENT_SESSION_LIFETIME, this value is not configurable.",
+            RuntimeWarning,
+        )
+    app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(weeks=52 * 4)
+
+    db.init_app(app)
+    with app.app_context():
+        configureSqlite(db.engine, app.config)
+        migrate(db)
+        inMemory = db.engine.url.database in (None, "", ":memory:")
+        isSqlite = db.engine.dialect.name == "sqlite"
+        # Workers forked from this process must not share its connections.
+        # An in-memory database only lives as long as its connection, though.
+        if not inMemory:
+            db.engine.dispose()
+
+    listConfigs = loadListConfigs(app)
+    wishlists = {slug: Wishlist(listSlug=slug, app=app) for slug in listConfigs}
+    renderCache = RenderCache(maxSize=app.config["RENDER_CACHE_SIZE"])
+    with app.app_context():
+        metrics = Metrics(app, db.engine, renderCache)
+    snapshots = None
+    if app.config.get("SNAPSHOT_DIR"):
+        snapshots = SnapshotPublisher(
+            app,
+            db,
+            wishlists,
+            app.config["SNAPSHOT_DIR"],
+            lambda listSlug, noSpoiler: renderSnapshot(app, listSlug, noSpoiler),
+        )
+    scheduler = Scheduler(app, db)
+    maintenance = Maintenance(app, db, wishlists)
+    scheduler.add(
+        "maintenance", app.config["MAINTENANCE_INTERVAL_HOURS"] * 3600, maintenance.run
+    )
+    backups = None
+    # An in-memory database is gone with the process, nothing to back up
+    if app.config["BACKUP_DIR"] and isSqlite and not inMemory:
+        backups = Backups(
+            app,
+            db,
+            os.path.join(app.instance_path, app.config["BACKUP_DIR"]),
+            app.config["BACKUP_COUNT"],
+        )
+        scheduler.add("backup", app.config["BACKUP_INTERVAL_HOURS"] * 3600, backups.create)
+    assetStore = AssetStore(app.static_folder, listConfigs)
+    app.extensions["wishlist"] = AppState(
+        listConfigs=listConfigs,
+        wishlists=wishlists,
+        renderCache=renderCache,
+        fragmentCache=RenderCache(maxSize=app.config["FRAGMENT_CACHE_SIZE"]),
+        metrics=metrics,
+        changeFeed=ChangeFeed(app, db),
+        assets=assetStore,
+        snapshots=snapshots,
+        scheduler=scheduler,
+        maintenance=maintenance,
+        backups=backups,
+        configFilePath=configFilePath,
+        fingerprint=appFingerprint(app, listConfigs, assetStore),
+    )
+
+    app.register_error_handler(404, page_not_found)
+    app.before_request(make_session_permanent)
+    app.before_request(clear_trailing)
+    app.before_request(startChangeFeed)
+    app.before_request(startScheduler)
+    app.context_processor(inject_config)
+    app.add_template_global(assetUrl)
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+
+    if snapshots is not None:
+        app.after_request(setViewCookie)
+        snapshots.publishAll()
+
+    # Added last, so list names can be checked against all routes
+    app.wsgi_app = ListDispatcher(app.wsgi_app, app, listConfigs)
+    return app
+
+
+def appFingerprint(app: Flask, listConfigs: dict, assets: AssetStore):
+    """
+    Part of every ETag, so browsers don't keep pages from before a deploy or a
+    settings change, which may point to assets that are gone. The same in
+    every worker process of a deployment.
+
+    Args:
+        app (Flask): the app
+        listConfigs (dict): settings of all lists by slug
+        assets (AssetStore): the assets the pages link to
+
+    Returns:
+        hash of the templates, assets and list settings
+    """
+    fingerprint = sha256(assets.fingerprint.encode())
+    for name in sorted(app.jinja_env.list_templates()):
+        source = app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+        fingerprint.update(f"{name}\0{source}\0".encode())
+    # The admin secret is part of the admin page's ETag where it matters
+    settings = {
+        slug: sorted((key, value) for key, value in listConfig.items() if key != "ADMIN_SECRET")
+        for slug, listConfig in sorted(listConfigs.items())
+    }
+    fingerprint.update(repr(settings).encode())
+    return fingerprint.hexdigest()[:12]
+
+
+def __getattr__(name):
+    # "app:app" for WSGI servers, created on first use instead of on import
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def startChangeFeed():
+    # Started by the first request, so the listener thread runs in the worker
+    # process and not in a master process it was forked from
+    if current_app.config["CHANGE_POLL_SECONDS"]:
+        changeFeed.start()
+
+
+def setViewCookie(response):
+    """
+    Tell the web server whether the visitor can get a snapshot, see
+    snapshots.viewCookieName.
+    """
+    if request.endpoint == "assetView":
+        return response
+    if session.get(SESSION_FULFILLED_WISHES) or session.get(SESSION_IS_LOGGED_IN):
+        view = VIEW_DYNAMIC
+    elif session.get(SESSION_NO_SPOILER):
+        view = VIEW_SNAPSHOT
+    else:
+        view = None
+
+    name = viewCookieName(currentListSlug())
+    if request.cookies.get(name) == view:
+        return response
+    path = request.script_root or "/"
+    if view is None:
+        response.delete_cookie(name, path=path)
+    else:
+        response.set_cookie(
+            name,
+            view,
+            max_age=current_app.config["PERMANENT_SESSION_LIFETIME"],
+            path=path,
+            samesite="Lax",
+        )
+    return response
+
+
+def startScheduler():
+    # Same as the change feed, the thread has to run in the worker process
+    _state().scheduler.start()
 
 
-@app.errorhandler(404)
 def page_not_found(e):
     # Redirect to lowercased path if necessary
     if any(x.isupper() for x in request.path):
-        return redirect(request.path.lower())
+        return redirect(request.script_root + request.path.lower())
 
     return error(
-        app=app,
+        app=current_app,
         code=404,
         title="Ungültige URL",
         message="Diese Seite gibt es nicht.",
     )
 
 
-@app.before_request
 def make_session_permanent():
     session.permanent = True
 
 
-@app.before_request
 def clear_trailing():
     if request.path != "/" and request.path.endswith("/"):
-        return redirect(request.path[:-1])
+        return redirect(request.script_root + request.path[:-1])
 
 
-@app.context_processor
 def inject_config():
     return {
-        "ownerName": app.config["OWNER_NAME"],
-        "themeHue": app.config["THEME_HUE"],
+        "ownerName": listConfig["OWNER_NAME"],
+        "themeStylesheet": assets.themeName(currentListSlug()),
         "description": (
-            app.config.get("DESCRIPTION").split("\n")
-            if app.config.get("DESCRIPTION")
+            listConfig["DESCRIPTION"].split("\n")
+            if listConfig["DESCRIPTION"]
             else None
         ),
     }
 
 
-@app.route("/")
+def assetUrl(filename: str):
+    """
+    Args:
+        filename (str): name of a file in the static folder
+
+    Returns:
+        the URL the file is served under, which changes whenever the file does
+    """
+    return url_for("assetView", name=assets.name(filename))
+
+
+@route("/assets/<name>")
+def assetView(name):
+    response = assets.response(name)
+    if response is None:
+        abort(404)
+    return response
+
+
+def wishRenderer(templateName: str, **context):
+    """
+    Get a function rendering a single WishView with the given template. Rendered
+    wishes are cached by everything they depend on, so when the wishlist changes
+    only the wishes that changed are rendered again.
+
+    Args:
+        templateName (str): name of the template for one wish
+        **context: additional template variables, have to be hashable
+
+    Returns:
+        function rendering a WishView to markup
+    """
+    template = current_app.jinja_env.get_template(templateName)
+    contextKey = (templateName, request.script_root, tuple(sorted(context.items())))
+
+    def renderWish(wish: WishView):
+        return Markup(
+            fragmentCache.getOrRender(
+                (contextKey, wish.cacheKey), lambda: template.render(wish=wish, **context)
+            )
+        )
+
+    return renderWish
+
+
+def giftedWishSecrets():
+    """
+    The secrets of the wishes the visitor fulfilled. Secrets of wishes that were
+    reopened or archived are dropped from the session whenever the wishlist
+    changed since the last check, so the session stays small. Deleted wishes
+    keep theirs, so the visitor still sees their gift if the wish is restored.
+
+    Returns:
+        frozenset of the secrets
+    """
+    secrets = session.get(SESSION_FULFILLED_WISHES, [])
+    version = wishlist.version if secrets else None
+    if secrets and session.get(SESSION_FULFILLED_WISHES_VERSION) != version:
+        stillFulfilled = wishlist.getFulfilledSecrets(secrets)
+        secrets = [secret for secret in secrets if secret in stillFulfilled]
+        session[SESSION_FULFILLED_WISHES] = secrets
+        session[SESSION_FULFILLED_WISHES_VERSION] = version
+    return frozenset(secrets)
+
+
+@route("/")
 def listView():
     if session.get(SESSION_NO_SPOILER):
         return redirect(url_for("noSpoilerView"))
 
-    return render_template(
+    secrets = giftedWishSecrets()
+    loggedIn = bool(session.get(SESSION_IS_LOGGED_IN))
+    version = wishlist.version
+    return conditional(
+        ("list", wishlist.listSlug, version, sorted(secrets), loggedIn),
+        lambda: renderCache.getOrStream(
+            ("list", wishlist.listSlug, version, secrets, loggedIn),
+            lambda: streamListPage(False, secrets, loggedIn),
+            isCurrent=versionUnchanged(version),
+        ),
+    )
+
+
+def versionUnchanged(version: int):
+    """
+    Args:
+        version (int): the version of the current list a page was rendered at
+
+    Returns:
+        function telling whether the list is still at that version, also
+        after the request context is gone
+    """
+    currentWishlist = wishlist._get_current_object()
+    return lambda: currentWishlist.version == version
+
+
+def streamListPage(noSpoiler: bool, secrets: frozenset, loggedIn: bool):
+    """
+    Args:
+        noSpoiler (bool): render the spoiler-free view
+        secrets (frozenset): secrets of the wishes the visitor fulfilled
+        loggedIn (bool): whether the visitor is an admin
+
+    Returns:
+        an iterator over the chunks of the list page
+    """
+    if noSpoiler:
+        wishes = wishlist.iterPriorityOrderedWishesNoSpoiler(giftedWishSecrets=secrets)
+        context = {"stats": wishlist.getStats()}
+    else:
+        wishes = wishlist.iterPriorityOrderedWishes(giftedWishSecrets=secrets)
+        context = {}
+    return streamTemplate(
         "list.html",
-        orderedWishlist=wishlist.getPriorityOrderedWishes(
-            giftedWishSecrets=session.get(SESSION_FULFILLED_WISHES, [])
+        orderedWishlist=(WishView(wish, secrets) for wish in wishes),
+        noSpoiler=noSpoiler,
+        renderWish=wishRenderer("list_wish.html", noSpoiler=noSpoiler),
+        loggedIn=loggedIn,
+        **context,
+    )
+
+
+def renderSnapshot(app: Flask, listSlug: str, noSpoiler: bool):
+    """
+    Render the list page an anonymous visitor gets, outside of a request.
+
+    Args:
+        app (Flask): the app
+        listSlug (str): the list
+        noSpoiler (bool): render the spoiler-free view
+
+    Returns:
+        the page
+    """
+    listConfig = app.extensions["wishlist"].listConfigs[listSlug]
+    # Lists with their own host are served from its root, the others under their name
+    scriptRoot = f"/{listSlug}" if listSlug and not listConfig.get("HOST") else ""
+    with app.test_request_context(
+        "/", environ_overrides={LIST_ENVIRON_KEY: listSlug, "SCRIPT_NAME": scriptRoot}
+    ):
+        return "".join(streamListPage(noSpoiler, frozenset(), loggedIn=False))
+
+
+@route("/search")
+def searchView():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return redirect(url_for("listView"))
+
+    secrets = giftedWishSecrets()
+    noSpoiler = bool(session.get(SESSION_NO_SPOILER))
+    loggedIn = bool(session.get(SESSION_IS_LOGGED_IN))
+    return conditional(
+        ("search", wishlist.listSlug, wishlist.version, query, sorted(secrets), noSpoiler, loggedIn),
+        lambda: render_template(
+            "list.html",
+            orderedWishlist=[WishView(wish, secrets) for wish in wishlist.search(query)],
+            query=query,
+            noSpoiler=noSpoiler,
+            renderWish=wishRenderer("list_wish.html", noSpoiler=noSpoiler),
+            loggedIn=loggedIn,
         ),
-        userFulfilledWishes=session.get(SESSION_FULFILLED_WISHES, []),
-        loggedIn=session.get(SESSION_IS_LOGGED_IN),
     )
 
 
-@app.route("/yes-spoiler")
+@route("/events")
+def eventsView():
+    return Response(
+        changeFeed.stream(
+            wishlist.listSlug,
+            afterID=request.headers.get("Last-Event-ID", type=int),
+            noSpoiler=bool(session.get(SESSION_NO_SPOILER)),
+        ),
+        mimetype="text/event-stream",
+        # Tell nginx not to buffer the events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@route("/yes-spoiler")
 def yesSpoiler():
     session[SESSION_NO_SPOILER] = False
     return redirect(url_for("listView"))
 
 
-@app.route("/no-spoiler")
+@route("/no-spoiler")
 def noSpoilerView():
     session[SESSION_NO_SPOILER] = True
-    return render_template(
-        "list.html",
-        orderedWishlist=wishlist.getPriorityOrderedWishesNoSpoiler(
-            giftedWishSecrets=session.get(SESSION_FULFILLED_WISHES, [])
+    secrets = giftedWishSecrets()
+    loggedIn = bool(session.get(SESSION_IS_LOGGED_IN))
+    version = wishlist.version
+    return conditional(
+        ("noSpoiler", wishlist.listSlug, version, sorted(secrets), loggedIn),
+        lambda: renderCache.getOrStream(
+            ("noSpoiler", wishlist.listSlug, version, secrets, loggedIn),
+            lambda: streamListPage(True, secrets, loggedIn),
+            isCurrent=versionUnchanged(version),
         ),
-        noSpoiler=True,
-        stats=wishlist.getStats(),
-        userFulfilledWishes=session.get(SESSION_FULFILLED_WISHES, []),
-        loggedIn=session.get(SESSION_IS_LOGGED_IN),
     )
 
 
-@app.route("/wishes/<int:id>", methods=["GET"])
+@route("/wishes/<int:id>", methods=["GET"])
 def wishView(id):
-    try:
-        wish = wishlist.getWishByID(id)
-    except WishNotFoundError:
-        return error(
-            app=app,
-            code=404,
-            title="Ungültige URL",
-            message="Es gibt keinen Wunsch mit dieser ID.",
-        )
-    if wish.isFulfilled():
-        return render_template(
-            "wish_already_fulfilled.html",
-            loggedIn=session.get(SESSION_IS_LOGGED_IN),
-        )
-    if wish.endless:
+    loggedIn = session.get(SESSION_IS_LOGGED_IN)
+
+    def render():
+        try:
+            wish = wishlist.getWishByID(id)
+        except WishNotFoundError:
+            return error(
+                app=current_app,
+                code=404,
+                title="Ungültige URL",
+                message="Es gibt keinen Wunsch mit dieser ID.",
+            )
+        if wish.isFulfilled():
+            return render_template(
+                "wish_already_fulfilled.html",
+                loggedIn=loggedIn,
+            )
+        if wish.endless:
+            return render_template(
+                "wish_endless.html",
+                wishTitle=wish.title,
+                loggedIn=loggedIn,
+            )
         return render_template(
-            "wish_endless.html",
+            "wish.html",
             wishTitle=wish.title,
-            loggedIn=session.get(SESSION_IS_LOGGED_IN),
+            loggedIn=loggedIn,
         )
-    return render_template(
-        "wish.html",
-        wishTitle=wish.title,
-        loggedIn=session.get(SESSION_IS_LOGGED_IN),
-    )
 
+    return conditional(("wish", wishlist.listSlug, id, wishlist.version, bool(loggedIn)), render)
 
-@app.route("/wishes/<int:id>", methods=["POST"])
+
+@route("/wishes/<int:id>", methods=["POST"])
 def wishFormSubmit(id):
-    if wishlist.getWishByID(id).endless:
-        return redirect(url_for("listView"))
-    giver = request.form["user_nickname"]
+    giver = request.form.get("user_nickname", "").strip()
+    if not giver:
+        return error(
+            app=current_app,
+            code=400,
+            title="Kein Name angegeben",
+            message="Bitte gib einen Namen an, damit der Wunsch als verschenkt gilt.",
+        )
     try:
-        try:
-            wishlist.markFulfilled(id, giver)
-        except WishFulfilledError:
-            return render_template("wish_already_fulfilled.html")
-        secret = wishlist.getWishByID(id).secret
+        wish = wishlist.markFulfilled(id, giver)
+    except WishEndlessError:
+        return redirect(url_for("listView"))
+    except WishFulfilledError:
+        return render_template("wish_already_fulfilled.html")
     except WishNotFoundError:
         return error(
-            app=app,
+            app=current_app,
             code=404,
             title="Ungültige URL",
             message="Es gibt keinen Wunsch mit dieser ID.",
         )
-    return redirect(url_for("thankYouView", id=id, secret=secret))
+    return redirect(url_for("thankYouView", id=id, secret=wish.secret))
 
 
-@app.route("/wishes/<int:id>/<secret>", methods=["GET"])
+@route("/wishes/<int:id>/<secret>", methods=["GET"])
 def thankYouView(id, secret):
     try:
         wish = wishlist.getWishByID(id)
     except WishNotFoundError:
         return error(
-            app=app,
+            app=current_app,
             code=404,
             title="Ungültige URL",
             message="Es gibt keinen Wunsch mit dieser ID.",
         )
     if wish.secret != secret:
         return error(
-            app=app,
+            app=current_app,
             code=403,
             title="Ungültige URL",
             message="Das angegebene Secret passt nicht zum Wunsch.",
         )
 
-    if not session.get(SESSION_FULFILLED_WISHES):
-        session[SESSION_FULFILLED_WISHES] = []
-    fulfilledWishesSet = set(session[SESSION_FULFILLED_WISHES])
-    fulfilledWishesSet.add(secret)
-    session[SESSION_FULFILLED_WISHES] = list(fulfilledWishesSet)
+    # Oldest first, only the most recent MAX_FULFILLED_WISHES are kept
+    fulfilledWishes = [
+        fulfilled for fulfilled in session.get(SESSION_FULFILLED_WISHES, []) if fulfilled != secret
+    ]
+    fulfilledWishes.append(secret)
+    session[SESSION_FULFILLED_WISHES] = fulfilledWishes[-current_app.config["MAX_FULFILLED_WISHES"] :]
 
     return render_template(
         "thank_you.html",
@@ -227,20 +702,20 @@ def thankYouView(id, secret):
     )
 
 
-@app.route("/wishes/<int:id>/<secret>", methods=["POST"])
+@route("/wishes/<int:id>/<secret>", methods=["POST"])
 def undoWishFulfillFormSubmit(id, secret):
     try:
-        wishlist.reopenWish(id)
+        wishlist.reopenWish(id, secret=secret)
     except SecretMismatchError:
         return error(
-            app=app,
+            app=current_app,
             code=403,
             title="Ungültige URL",
             message="Das angegebene Secret passt nicht zum Wunsch.",
         )
     except WishNotFoundError:
         return error(
-            app=app,
+            app=current_app,
             code=404,
             title="Ungültige URL",
             message="Es gibt keinen Wunsch mit dieser ID.",
@@ -248,84 +723,145 @@ def undoWishFulfillFormSubmit(id, secret):
     return redirect(url_for("listView"))
 
 
-@app.route("/login/<secret>", methods=["GET"])
+@route("/login/<secret>", methods=["GET"])
 def loginView(secret):
-    if secret == app.config["ADMIN_SECRET"]:
+    if secret == listConfig["ADMIN_SECRET"]:
         session[SESSION_IS_LOGGED_IN] = True
         return redirect(url_for("adminView"))
     else:
         return error(
-            app=app,
+            app=current_app,
             code=404,
             title="Ungültige URL",
             message="Dieser Login-Link ist ungültig. Solltest du den Login-Link verloren haben, kannst du das Secret in deiner Config-Datei finden.",
         )
 
 
-@app.route("/admin", methods=["GET"])
-@admin(app)
-def adminView():
-    session[SESSION_NO_SPOILER] = True
-    return render_template(
+def renderAdmin(deletedBefore: int | None = None, query: str | None = None, **context):
+    """
+    Stream the admin page. Deleted wishes are shown a page at a time.
+
+    Args:
+        deletedBefore (int, optional): ID of a deleted wish, only show wishes deleted before it.
+            Defaults to None, start with the most recently deleted one.
+        query (str, optional): only show the active wishes matching this search. Defaults to None.
+        **context: additional template variables, like a message to show
+
+    Returns:
+        the chunks of the admin page
+    """
+    snapshot = wishlist.getAdminSnapshot()
+    pageSize = current_app.config["DELETED_WISHES_PAGE_SIZE"]
+    deletedWishes = wishlist.getDeletedWishes(limit=pageSize + 1, before=deletedBefore)
+    if query:
+        activeWishes = [WishView(wish) for wish in wishlist.search(query)]
+        context["query"] = query
+    else:
+        activeWishes = snapshot.activeWishes
+    return streamTemplate(
         "admin.html",
-        loginLink=url_for(
-            "loginView", secret=app.config["ADMIN_SECRET"], _external=True
+        loginLink=url_for("loginView", secret=listConfig["ADMIN_SECRET"], _external=True),
+        orderedWishlist=activeWishes,
+        renderWish=wishRenderer("admin_wish.html"),
+        stats=snapshot.stats,
+        orderedDeletedWishlist=deletedWishes[:pageSize],
+        nextDeletedWishID=(
+            deletedWishes[pageSize - 1].id if len(deletedWishes) > pageSize else None
         ),
-        orderedWishlist=wishlist.getPriorityOrderedWishesNoSpoiler(),
-        stats=wishlist.getStats(),
-        orderedDeletedWishlist=wishlist.getDeletedWishes(),
+        showDeletedWishes=deletedBefore is not None,
         loggedIn=session.get(SESSION_IS_LOGGED_IN),
+        backups=listBackups(),
+        **context,
     )
 
 
-@app.route("/admin", methods=["POST"])
-@admin(app)
+@route("/admin", methods=["GET"])
+@admin()
+def adminView():
+    session[SESSION_NO_SPOILER] = True
+    deletedBefore = request.args.get("deletedBefore", type=int)
+    query = request.args.get("q", "").strip()
+    loginLink = url_for("loginView", secret=listConfig["ADMIN_SECRET"], _external=True)
+    backups = listBackups()
+    latestBackup = backups[0].name if backups else None
+    return conditional(
+        ("admin", wishlist.listSlug, wishlist.version, loginLink, deletedBefore, query, latestBackup),
+        lambda: renderAdmin(deletedBefore=deletedBefore, query=query),
+    )
+
+
+@route("/admin", methods=["POST"])
+@admin()
 def adminFormSubmit():
     if request.form["action"] == "delete":
         wishID = request.form["wishId"]
-        wishlist.delWish(id=wishID)
-        return render_template(
-            "admin.html",
-            loginLink=url_for(
-                "loginView", secret=app.config["ADMIN_SECRET"], _external=True
-            ),
-            orderedWishlist=wishlist.getPriorityOrderedWishesNoSpoiler(),
-            stats=wishlist.getStats(),
-            orderedDeletedWishlist=wishlist.getDeletedWishes(),
-            message=f'Wunsch "{wishlist.getWishByID(wishID).title}" erfolgreich gelöscht!',
+        wish = wishlist.delWish(id=wishID)
+        return renderAdmin(
+            message=f'Wunsch "{wish.title}" erfolgreich gelöscht!',
             messageUndo={"action": "restore", "wishID": wishID},
-            loggedIn=session.get(SESSION_IS_LOGGED_IN),
         )
     elif request.form["action"] == "restore":
         wishID = request.form["wishId"]
-        wishlist.undelWish(id=wishID)
-        return render_template(
-            "admin.html",
-            loginLink=url_for(
-                "loginView", secret=app.config["ADMIN_SECRET"], _external=True
-            ),
-            orderedWishlist=wishlist.getPriorityOrderedWishesNoSpoiler(),
-            stats=wishlist.getStats(),
-            orderedDeletedWishlist=wishlist.getDeletedWishes(),
-            message=f'Wunsch "{wishlist.getWishByID(wishID).title}" wurde wiederhergestellt.',
+        wish = wishlist.undelWish(id=wishID)
+        return renderAdmin(
+            message=f'Wunsch "{wish.title}" wurde wiederhergestellt.',
             messageUndo={"action": "delete", "wishID": wishID},
-            loggedIn=session.get(SESSION_IS_LOGGED_IN),
         )
     elif request.form["action"] == "regenerateAdminLink":
+        adminSecret = secrets.token_hex()
+        configFilePath = current_app.extensions["wishlist"].configFilePath
+        # Apps created with an explicit config have no config file to keep the secret in
+        if configFilePath is not None:
+            configFileContents = readConfigFile(configFilePath)
+            if wishlist.listSlug:
+                configFileContents.setdefault("LISTS", {}).setdefault(wishlist.listSlug, {})[
+                    "ADMIN_SECRET"
+                ] = adminSecret
+            else:
+                configFileContents["ADMIN_SECRET"] = adminSecret
+            writeConfigFile(configFilePath, configFileContents)
+        if not wishlist.listSlug:
+            current_app.config["ADMIN_SECRET"] = adminSecret
+        listConfig["ADMIN_SECRET"] = adminSecret
+    elif request.form["action"] == "backup" and mainListBackups() is not None:
         try:
-            with open("config/config.toml", "rb") as f:
-                configFileContents = tomllib.load(f)
-        except FileNotFoundError:
-            configFileContents = {}
-        configFileContents["ADMIN_SECRET"] = secrets.token_hex()
-        with open("config/config.toml", "wb") as f:
-            tomli_w.dump(configFileContents, f)
-        app.config.from_mapping(configFileContents)
+            report = mainListBackups().create()
+        except BackupError:
+            current_app.logger.exception("Backup failed")
+            return renderAdmin(message="Das Backup ist fehlgeschlagen, die Kopie war beschädigt.")
+        except OSError:
+            current_app.logger.exception("Backup failed")
+            return renderAdmin(
+                message="Das Backup ist fehlgeschlagen, die Datei konnte nicht geschrieben werden."
+            )
+        return renderAdmin(
+            message=f'Backup "{report["name"]}" erstellt und geprüft ({report["compressedBytes"] // 1024} KiB).'
+        )
     return redirect(url_for("adminView"))
 
 
-@app.route("/admin/addWish", methods=["GET"])
-@admin(app)
+def mainListBackups():
+    """
+    The backups hold the database of all lists, so only the main list's admin
+    gets to see and make them.
+
+    Returns:
+        Backups or None if backups are turned off or this isn't the main list
+    """
+    return _state().backups if currentListSlug() == DEFAULT_LIST else None
+
+
+def listBackups():
+    """
+    Returns:
+        the kept backups, newest first, None if the admin can't see backups
+    """
+    backups = mainListBackups()
+    return backups.list() if backups is not None else None
+
+
+@route("/admin/addWish", methods=["GET"])
+@admin()
 def addWishView():
     template = None
     if request.args.get("copy"):
@@ -343,8 +879,8 @@ def addWishView():
     )
 
 
-@app.route("/admin/addWish", methods=["POST"])
-@admin(app)
+@route("/admin/addWish", methods=["POST"])
+@admin()
 def addWishFormSubmit():
     wishlist.addWish(
         title=request.form["title"],
@@ -357,14 +893,49 @@ def addWishFormSubmit():
     return redirect(url_for("adminView"))
 
 
-@app.route("/admin/editWish/<int:id>", methods=["GET"])
-@admin(app)
+@route("/admin/export.<format>", methods=["GET"])
+@admin()
+def exportView(format):
+    if format not in WRITERS:
+        return error(
+            app=current_app,
+            code=404,
+            title="Ungültige URL",
+            message="Dieses Export-Format gibt es nicht.",
+        )
+    return Response(
+        stream_with_context(WRITERS[format](wishlist.exportAll())),
+        mimetype=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="wishes.{format}"'},
+    )
+
+
+@route("/admin/import", methods=["POST"])
+@admin()
+def importFormSubmit():
+    file = request.files.get("file")
+    if not file or not file.filename:
+        message = "Bitte wähle eine Datei zum Importieren aus."
+    else:
+        format = "csv" if file.filename.lower().endswith(".csv") else "jsonl"
+        # Read the upload line by line instead of loading it into memory at once
+        stream = TextIOWrapper(file.stream, encoding="utf-8-sig", newline="")
+        try:
+            count = wishlist.bulkAdd(READERS[format](stream))
+            message = f"{count} Wünsche importiert."
+        except (ValueError, UnicodeDecodeError) as e:
+            message = f"Import fehlgeschlagen, es wurde nichts importiert. {e}"
+    return renderAdmin(message=message)
+
+
+@route("/admin/editWish/<int:id>", methods=["GET"])
+@admin()
 def editWishView(id):
     try:
         wish = wishlist.getWishByID(id)
     except WishNotFoundError:
         return error(
-            app=app,
+            app=current_app,
             code=404,
             title="Ungültige URL",
             message="Es gibt keinen Wunsch mit dieser ID.",
@@ -380,8 +951,8 @@ def editWishView(id):
     )
 
 
-@app.route("/admin/editWish/<int:id>", methods=["POST"])
-@admin(app)
+@route("/admin/editWish/<int:id>", methods=["POST"])
+@admin()
 def editWishFormSubmit(id):
     wishlist.modifyWish(
         id=id,
@@ -395,8 +966,115 @@ def editWishFormSubmit(id):
     return redirect(url_for("adminView"))
 
 
-@app.route("/admin/logout")
-@admin(app)
+@route("/api/changes")
+@admin(tokenConfigKey="API_TOKEN", jsonErrors=True)
+def changesView():
+    since = request.args.get("since", type=int)
+    if since is None:
+        version, wishes = wishlist.getSnapshot()
+        return jsonify(version=version, wishes=wishes)
+
+    limit = min(request.args.get("limit", CHANGES_PAGE_SIZE, type=int), CHANGES_PAGE_SIZE)
+    try:
+        changes, version, hasMore = wishlist.getChanges(since, max(limit, 1))
+    except ChangesExpiredError:
+        return jsonError(410, "Diese Version ist zu alt, bitte die ganze Liste neu laden.")
+    return jsonify(version=version, changes=changes, more=hasMore)
+
+
+def apiViewer(isAdminRequest: bool):
+    noSpoiler = request.args.get("noSpoiler")
+    if noSpoiler is None:
+        noSpoiler = session.get(SESSION_NO_SPOILER, False)
+    else:
+        noSpoiler = noSpoiler.lower() in ("1", "true", "yes")
+    return Viewer(giftedWishSecrets(), bool(noSpoiler), isAdminRequest)
+
+
+@route("/api/wishes")
+def apiWishesView():
+    viewer = apiViewer(isAdmin(tokenConfigKey="API_TOKEN"))
+    try:
+        fields = selectFields(request.args.get("fields"), viewer.isAdmin)
+    except ValueError as e:
+        return jsonError(400, str(e))
+
+    if "ids" in request.args:
+        ids = [id for id in request.args["ids"].split(",") if id.strip()]
+        if len(ids) > API_BATCH_SIZE:
+            return jsonError(400, f"Höchstens {API_BATCH_SIZE} IDs auf einmal.")
+        try:
+            wishes = wishlist.getWishesByIDs(ids, includeDeleted=viewer.isAdmin)
+        except WishNotFoundError as e:
+            return jsonError(400, f"Ungültige ID: {e.wishId}")
+        return Response("".join(writeJson(wishes, fields, viewer)), mimetype="application/json")
+
+    if viewer.noSpoiler:
+        iterWishes = wishlist.iterPriorityOrderedWishesNoSpoiler
+    else:
+        iterWishes = wishlist.iterPriorityOrderedWishes
+    return conditional(
+        (
+            "api",
+            wishlist.listSlug,
+            wishlist.version,
+            sorted(viewer.giftedWishSecrets),
+            viewer.noSpoiler,
+            viewer.isAdmin,
+            [name for name, _ in fields],
+        ),
+        lambda: Response(
+            stream_with_context(writeJson(iterWishes(viewer.giftedWishSecrets), fields, viewer)),
+            mimetype="application/json",
+        ),
+    )
+
+
+@route("/api/wishes/batch", methods=["POST"])
+@admin(tokenConfigKey="API_TOKEN", jsonErrors=True)
+def apiBatchView():
+    body = request.get_json(silent=True)
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not all(isinstance(o, dict) for o in operations):
+        return jsonError(400, 'Erwartet wird ein JSON-Objekt mit einer Liste "operations".')
+    if len(operations) > API_BATCH_SIZE:
+        return jsonError(400, f"Höchstens {API_BATCH_SIZE} Operationen auf einmal.")
+    viewer = apiViewer(True)
+    try:
+        fields = selectFields(request.args.get("fields"), viewer.isAdmin)
+    except ValueError as e:
+        return jsonError(400, str(e))
+
+    try:
+        wishes = wishlist.applyBatch(operations)
+    except BatchOperationError as e:
+        if isinstance(e.error, WishNotFoundError):
+            code = 404
+        elif isinstance(e.error, (WishFulfilledError, WishEndlessError)):
+            code = 409
+        else:
+            code = 400
+        return jsonify(error=str(e.error), index=e.index), code
+    return Response("".join(writeJson(wishes, fields, viewer)), mimetype="application/json")
+
+
+@route("/api/jobs")
+@defaultListOnly
+@admin(tokenConfigKey="API_TOKEN", jsonErrors=True)
+def jobsView():
+    return jsonify(_state().scheduler.getRuns())
+
+
+@route("/metrics")
+@defaultListOnly
+@admin(tokenConfigKey="METRICS_TOKEN")
+def metricsView():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@route("/admin/logout")
+@admin()
 def logout():
     session[SESSION_IS_LOGGED_IN] = False
     return redirect(url_for("listView"))
+
@@ -0,0 +1,135 @@
+import gzip
+import mimetypes
+import os
+from hashlib import sha256
+from typing import NamedTuple
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Assets are only ever served under the hash of their content, so they never change
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _gzip(content: bytes):
+    # No timestamp, so every worker builds the same bytes
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+# Content encodings in order of preference, with the function producing them
+ENCODINGS = [("br", brotli.compress if brotli else None), ("gzip", _gzip)]
+
+
+class Asset(NamedTuple):
+    mimetype: str
+    etag: str
+    # content by encoding, "identity" is always there
+    variants: dict
+
+
+def _compressVariants(content: bytes):
+    variants = {"identity": content}
+    for encoding, compress in ENCODINGS:
+        if compress is None:
+            continue
+        compressed = compress(content)
+        # Not worth it for tiny files
+        if len(compressed) < len(content):
+            variants[encoding] = compressed
+    return variants
+
+
+class AssetStore:
+    def __init__(self, staticFolder: str, listConfigs: dict):
+        """
+        Static files and the theme stylesheet of every list, built once at startup.
+
+        Every asset is served under a name containing the hash of its content,
+        e.g. style.3f2a9c1b7d4e.css, so browsers can keep it for good and a
+        changed file gets a new URL. Gzip and, if the brotli package is
+        installed, brotli variants are compressed ahead of time.
+
+        Args:
+            staticFolder (str): folder with the static files
+            listConfigs (dict): settings of all lists by slug, for their THEME_HUE
+        """
+        self._assets = {}
+        # fingerprinted name by original name
+        self._names = {}
+        for filename in sorted(os.listdir(staticFolder)):
+            path = os.path.join(staticFolder, filename)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    self._names[filename] = self.__add(filename, f.read())
+        self._themes = {
+            slug: self.__add(
+                "theme.css", f":root {{ --hue-theme: {int(listConfig['THEME_HUE'])}; }}\n".encode()
+            )
+            for slug, listConfig in listConfigs.items()
+        }
+
+    def __add(self, filename: str, content: bytes):
+        digest = sha256(content).hexdigest()[:12]
+        stem, extension = os.path.splitext(filename)
+        name = f"{stem}.{digest}{extension}"
+        if name not in self._assets:
+            mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            self._assets[name] = Asset(mimetype, digest, _compressVariants(content))
+        return name
+
+    @property
+    def fingerprint(self):
+        """Hash of all served assets, changes whenever one of them does."""
+        return sha256(" ".join(sorted(self._assets)).encode()).hexdigest()[:12]
+
+    def name(self, filename: str):
+        """
+        Args:
+            filename (str): name of a file in the static folder
+
+        Raises:
+            KeyError: Is raised if there is no such file.
+
+        Returns:
+            the name the file is served under
+        """
+        return self._names[filename]
+
+    def themeName(self, listSlug: str):
+        """
+        Returns:
+            the name the theme stylesheet of the list is served under
+        """
+        return self._themes[listSlug]
+
+    def response(self, name: str):
+        """
+        Answer a request for an asset, in the best encoding the client accepts.
+
+        Returns:
+            the response, None if there is no asset with that name
+        """
+        asset = self._assets.get(name)
+        if asset is None:
+            return None
+        # All encodings share the ETag, so it is a weak one: the representations
+        # differ in bytes, not in content
+        if request.if_none_match.contains_weak(asset.etag):
+            response = Response(status=304)
+        else:
+            encoding = "identity"
+            for candidate, _ in ENCODINGS:
+                if candidate in asset.variants and request.accept_encodings[candidate]:
+                    encoding = candidate
+                    break
+            response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding != "identity":
+                response.content_encoding = encoding
+        response.set_etag(asset.etag, weak=True)
+        response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+        response.vary.add("Accept-Encoding")
+        return response
@@ -0,0 +1,159 @@
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from threading import Lock
+from time import monotonic, sleep
+from typing import NamedTuple
+
+from flask import Flask
+
+# Name of a backup file, with the time it was made
+BACKUP_NAME_PATTERN = re.compile(r"^wishes-(\d{8}-\d{6})(-\d+)?\.sqlite3\.gz$")
+# Pages copied per backup step. The database isn't locked between steps.
+BACKUP_STEP_PAGES = 256
+# Pause between backup steps, so writers get the database in between
+BACKUP_STEP_PAUSE_SECONDS = 0.005
+
+
+class BackupFile(NamedTuple):
+    name: str
+    sizeBytes: int
+    created: datetime
+
+
+def _backupOrder(backup: BackupFile):
+    # Backups made within the same second are counted up after the time
+    counter = BACKUP_NAME_PATTERN.match(backup.name).group(2)
+    return backup.created, int(counter[1:]) if counter else 0
+
+
+class Backups:
+    def __init__(self, app: Flask, db, directory: str, keep: int):
+        """
+        Makes compressed copies of the running database with SQLite's online
+        backup API and keeps the newest of them.
+
+        Args:
+            app (Flask): the app
+            db (SQLAlchemy): the database, has to be SQLite
+            directory (str): where to keep the backups
+            keep (int): how many backups to keep, older ones are deleted
+        """
+        self.app = app
+        self.db = db
+        self.directory = directory
+        self.keep = keep
+        self._lock = Lock()
+
+    def create(self):
+        """
+        Copy the database a few pages at a time, check the copy's integrity and
+        store it gzipped. Has to be called within the app.app_context().
+
+        Raises:
+            BackupError: Is raised if the copy is damaged. It is not kept.
+
+        Returns:
+            dict with the name, sizes and duration of the backup
+        """
+        with self._lock:
+            started = monotonic()
+            os.makedirs(self.directory, exist_ok=True)
+            handle, copyPath = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+            os.close(handle)
+            compressedPath = copyPath + ".gz"
+            try:
+                self.__copyDatabase(copyPath)
+                with open(copyPath, "rb") as source, gzip.open(compressedPath, "wb") as target:
+                    shutil.copyfileobj(source, target)
+                name = self.__newName()
+                os.replace(compressedPath, os.path.join(self.directory, name))
+                report = {
+                    "name": name,
+                    "sizeBytes": os.path.getsize(copyPath),
+                    "compressedBytes": os.path.getsize(os.path.join(self.directory, name)),
+                }
+            finally:
+                for path in (copyPath, compressedPath):
+                    if os.path.exists(path):
+                        os.unlink(path)
+            report["deleted"] = self.__rotate()
+        report["seconds"] = round(monotonic() - started, 3)
+        self.app.logger.info(
+            "Backup %s: %d bytes, %d compressed, in %.1f s",
+            report["name"],
+            report["sizeBytes"],
+            report["compressedBytes"],
+            report["seconds"],
+        )
+        return report
+
+    def list(self):
+        """
+        Returns:
+            the kept backups, newest first
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        backups = []
+        for name in names:
+            match = BACKUP_NAME_PATTERN.match(name)
+            if match:
+                backups.append(
+                    BackupFile(
+                        name,
+                        os.path.getsize(os.path.join(self.directory, name)),
+                        datetime.strptime(match.group(1), "%Y%m%d-%H%M%S"),
+                    )
+                )
+        backups.sort(key=_backupOrder, reverse=True)
+        return backups
+
+    def __copyDatabase(self, path: str):
+        with self.db.engine.connect() as connection:
+            source = connection.connection.driver_connection
+            copy = sqlite3.connect(path)
+            try:
+                source.backup(
+                    copy,
+                    pages=BACKUP_STEP_PAGES,
+                    progress=lambda status, remaining, total: sleep(BACKUP_STEP_PAUSE_SECONDS),
+                )
+                # A single file that can be restored by putting it in place
+                copy.execute("PRAGMA journal_mode = DELETE")
+                problems = [row[0] for row in copy.execute("PRAGMA integrity_check")]
+            finally:
+                copy.close()
+        if problems != ["ok"]:
+            raise BackupError("; ".join(problems))
+
+    def __newName(self):
+        stem = datetime.now().strftime("wishes-%Y%m%d-%H%M%S")
+        name = f"{stem}.sqlite3.gz"
+        counter = 1
+        while os.path.exists(os.path.join(self.directory, name)):
+            name = f"{stem}-{counter}.sqlite3.gz"
+            counter += 1
+        return name
+
+    def __rotate(self):
+        deleted = []
+        for backup in self.list()[max(self.keep, 1) :]:
+            os.unlink(os.path.join(self.directory, backup.name))
+            deleted.append(backup.name)
+        return deleted
+
+
+class BackupError(ValueError):
+    def __init__(self, problems: str, *args):
+        super().__init__(problems, *args)
+        self.problems = problems
+
+    def __str__(self):
+        return f"The backup failed the integrity check: {self.problems}"
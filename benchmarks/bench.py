@@ -0,0 +1,308 @@
+"""
+Benchmarks for the wishlist routes against seeded SQLite databases.
+
+Every size runs in its own process with a fresh database, so caches and memory
+use of one size don't affect the next. Run from the repository root:
+
+    python benchmarks/bench.py --sizes 100 10000 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def seedRecords(size: int, rng: random.Random):
+    """
+    Yield wishes for Wishlist.bulkAdd: about 20 % fulfilled, 5 % endless and
+    10 % soft-deleted, the rest open.
+    """
+    from datetime import datetime, timedelta
+
+    for i in range(size):
+        roll = rng.random()
+        record = {
+            "title": f"Wunsch {i}",
+            "priority": rng.randint(1, 5),
+            "desc": "Beschreibung " * rng.randint(0, 8),
+            "link": f"https://www.example.com/item/{i}" if rng.random() < 0.5 else "",
+        }
+        if roll < 0.2:
+            record["giver"] = f"Schenker {i}"
+            record["secret"] = uuid4().hex
+        elif roll < 0.25:
+            record["endless"] = True
+        elif roll < 0.35:
+            record["deleted"] = datetime.now() - timedelta(days=rng.randint(0, 700))
+        yield record
+
+
+class QueryCounter:
+    """Counts SQL statements per thread via SQLAlchemy engine events."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.local = threading.local()
+        event.listen(engine, "before_cursor_execute", self.count)
+
+    def count(self, *args):
+        self.local.count = getattr(self.local, "count", 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def value(self):
+        return getattr(self.local, "count", 0)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(name, requestFunction, counter, maxRequests, maxSeconds):
+    latencies = []
+    queries = []
+    started = time.perf_counter()
+    while len(latencies) < maxRequests and (
+        len(latencies) < 3 or time.perf_counter() - started < maxSeconds
+    ):
+        counter.reset()
+        before = time.perf_counter()
+        response = requestFunction(len(latencies))
+        # Streamed pages are only rendered while the body is read
+        response.get_data()
+        latencies.append((time.perf_counter() - before) * 1000)
+        queries.append(counter.value)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name} answered {response.status_code}")
+    return {
+        "route": name,
+        "requests": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p90_ms": percentile(latencies, 0.9),
+        "p99_ms": percentile(latencies, 0.99),
+        "queries_per_request": statistics.mean(queries),
+    }
+
+
+def loadTest(app, paths, threads, requestsPerThread, maxSeconds):
+    """Hit the given GET paths from several threads, each with its own client."""
+    deadline = time.perf_counter() + maxSeconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        done = 0
+        while done < requestsPerThread and time.perf_counter() < deadline:
+            client.get(rng.choice(paths)).get_data()
+            done += 1
+        return done
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        done = sum(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+    return {
+        "threads": threads,
+        "requests": done,
+        "throughput_rps": done / elapsed,
+    }
+
+
+def runSize(args):
+    """Seed one database and benchmark it. Runs in a child process."""
+    sys.path.insert(0, REPO_ROOT)
+    from app import create_app
+    from database import db
+    from sqlalchemy import select
+    from wishes import Wish
+
+    # Explicit config, so neither config/config.toml nor the scheduled jobs get involved
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + args.database,
+            "RENDER_CACHE_SIZE": args.render_cache_size,
+            "BACKUP_DIR": "",
+            "MAINTENANCE_INTERVAL_HOURS": 0,
+            "CHANGE_POLL_SECONDS": 0,
+        }
+    )
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    wishlist.bulkAdd(seedRecords(args.run, rng))
+    seedSeconds = time.perf_counter() - started
+
+    with app.app_context():
+        openIDs = db.session.scalars(
+            select(Wish.id).where(
+                (Wish.giver == "") & (Wish.endless == False) & (Wish.deleted == None)
+            )
+        ).all()
+        someSecrets = db.session.scalars(
+            select(Wish.secret).where(Wish.secret != None).limit(5)
+        ).all()
+        counter = QueryCounter(db.engine)
+    rng.shuffle(openIDs)
+
+    visitor = app.test_client()
+    gifter = app.test_client()
+    with gifter.session_transaction() as session:
+        session["fulfilledWishes"] = someSecrets
+    admin = app.test_client()
+    with admin.session_transaction() as session:
+        session["isLoggedIn"] = True
+    if len(openIDs) < 3:
+        sys.exit(f"{args.run} wishes are too few, the benchmark needs at least three open ones.")
+    adminWishID = openIDs.pop()
+    # Every fulfill needs an open wish of its own. openIDs[0] stays open for the load test.
+    fulfillIDs = openIDs[1:]
+
+    scenarios = [
+        ("GET / (listView)", lambda i: visitor.get("/")),
+        ("GET / with gifted wishes", lambda i: gifter.get("/")),
+        ("GET /no-spoiler (noSpoilerView)", lambda i: gifter.get("/no-spoiler")),
+        (
+            "GET /wishes/<id> (wishView)",
+            lambda i: visitor.get(f"/wishes/{openIDs[i % len(openIDs)]}"),
+        ),
+        (
+            "POST /wishes/<id> (wishFormSubmit)",
+            lambda i: visitor.post(f"/wishes/{fulfillIDs[i]}", data={"user_nickname": "Benchmark"}),
+        ),
+        ("GET /admin (adminView)", lambda i: admin.get("/admin")),
+        (
+            "POST /admin (adminFormSubmit)",
+            lambda i: admin.post(
+                "/admin",
+                data={
+                    "action": "delete" if i % 2 == 0 else "restore",
+                    "wishId": adminWishID,
+                },
+            ),
+        ),
+    ]
+    requestLimits = {"POST /wishes/<id> (wishFormSubmit)": len(fulfillIDs)}
+    results = [
+        measure(
+            name,
+            function,
+            counter,
+            min(args.requests, requestLimits.get(name, args.requests)),
+            args.max_seconds,
+        )
+        for name, function in scenarios
+    ]
+    load = loadTest(
+        app,
+        ["/", "/no-spoiler", f"/wishes/{openIDs[0]}"],
+        args.threads,
+        args.load_requests,
+        args.max_seconds,
+    )
+    print(
+        json.dumps(
+            {
+                "size": args.run,
+                "seed_seconds": seedSeconds,
+                "routes": results,
+                "load": load,
+            }
+        )
+    )
+
+
+def printReport(report):
+    print(
+        f"\n{report['size']} wishes (seeded in {report['seed_seconds']:.1f} s)"
+    )
+    print(
+        f"{'route':<38} {'n':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'queries':>8}"
+    )
+    for route in report["routes"]:
+        print(
+            f"{route['route']:<38} {route['requests']:>5} {route['p50_ms']:>9.2f}"
+            f" {route['p90_ms']:>9.2f} {route['p99_ms']:>9.2f}"
+            f" {route['queries_per_request']:>8.1f}"
+        )
+    load = report["load"]
+    print(
+        f"load: {load['requests']} GETs from {load['threads']} threads,"
+        f" {load['throughput_rps']:.1f} requests/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--requests", type=int, default=50, help="max requests per route")
+    parser.add_argument(
+        "--max-seconds", type=float, default=10, help="max time per route (at least 3 requests)"
+    )
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--load-requests", type=int, default=25, help="requests per load thread")
+    parser.add_argument(
+        "--render-cache-size",
+        type=int,
+        default=0,
+        help="RENDER_CACHE_SIZE for the run, 0 measures every request uncached",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        runSize(args)
+        return
+
+    reports = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--run",
+                    str(size),
+                    "--database",
+                    os.path.join(directory, "bench.sqlite3"),
+                ]
+                + [
+                    f"--{name.replace('_', '-')}={value}"
+                    for name, value in vars(args).items()
+                    if name
+                    in ("requests", "max_seconds", "threads", "load_requests", "render_cache_size", "seed")
+                ],
+                capture_output=True,
+                text=True,
+            )
+        if output.returncode != 0:
+            sys.exit(f"Benchmark with {size} wishes failed:\n{output.stderr}")
+        report = json.loads(output.stdout.strip().splitlines()[-1])
+        printReport(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable, Iterable
+
+# Returned by __lookup on a miss, as None could be a cached value
+_MISS = object()
+
+
+class RenderCache:
+    def __init__(self, maxSize: int = 256):
+        """
+        Bounded LRU cache for rendered pages.
+
+        Args:
+            maxSize (int, optional): Maximum number of cached pages. 0 disables the cache. Defaults to 256.
+        """
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def getOrRender(self, key: Hashable, render: Callable[[], str]):
+        """
+        Return the cached page for key, rendering and storing it on a miss.
+
+        Args:
+            key (Hashable): Cache key. Must contain everything the rendered page depends on.
+            render (Callable[[], str]): Called without arguments to render the page on a miss.
+
+        Returns:
+            the rendered page
+        """
+        page = self.__lookup(key)
+        if page is not _MISS:
+            return page
+
+        page = render()
+        self.__store(key, page)
+        return page
+
+    def getOrStream(
+        self,
+        key: Hashable,
+        stream: Callable[[], Iterable[str]],
+        isCurrent: Callable[[], bool] | None = None,
+    ):
+        """
+        Return the cached page for key. On a miss, return the chunks of the
+        page as they are rendered and store the page once it is complete.
+
+        Args:
+            key (Hashable): Cache key. Must contain everything the rendered page depends on.
+            stream (Callable[[], Iterable[str]]): Called without arguments on a miss,
+                returns the page in chunks.
+            isCurrent (Callable[[], bool], optional): Called without arguments once the
+                page is complete, it is only stored if this returns True. For pages
+                whose data can change while they are streamed. Defaults to always storing.
+
+        Returns:
+            the cached page, or an iterator over the chunks of the page
+        """
+        page = self.__lookup(key)
+        if page is not _MISS:
+            return page
+
+        # Called right away so rendering starts while the request context is active
+        chunks = stream()
+
+        def tee():
+            rendered = []
+            for chunk in chunks:
+                rendered.append(chunk)
+                yield chunk
+            if isCurrent is None or isCurrent():
+                self.__store(key, "".join(rendered))
+
+        return tee()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        return _MISS
+
+    def __store(self, key, page):
+        if self.maxSize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
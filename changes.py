@@ -0,0 +1,154 @@
+import json
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from typing import NamedTuple
+
+from flask import Flask
+from sqlalchemy import func, select
+
+from wishes import WishChange, wishlistChanged
+
+# Changes that reveal whether a wish was fulfilled, not sent to no-spoiler views
+SPOILER_KINDS = ("fulfilled", "reopened")
+# Send a comment this often on idle streams, so proxies keep them open and
+# closed connections are noticed
+KEEPALIVE_SECONDS = 15
+
+
+class Change(NamedTuple):
+    id: int
+    listSlug: str
+    wishId: int | None
+    kind: str
+
+
+class ChangeFeed:
+    def __init__(self, app: Flask, db, bufferSize: int = 1000):
+        """
+        Delivers the changes to all wishlists to the event streams of this process.
+
+        A single listener thread reads new rows from the wish_changes table, so
+        changes made by other worker processes arrive as well. It wakes up right
+        away for changes made in this process and every CHANGE_POLL_SECONDS
+        otherwise.
+
+        Args:
+            app (Flask): the app
+            db (SQLAlchemy): the database
+            bufferSize (int, optional): how many recent changes to keep for
+                reconnecting streams. Defaults to 1000.
+        """
+        self.app = app
+        self.db = db
+        self.lastID = 0
+        self._changes = deque(maxlen=bufferSize)
+        self._condition = Condition()
+        self._wakeup = Event()
+        self._startLock = Lock()
+        self._started = False
+
+    def start(self):
+        """
+        Start the listener thread, unless it is already running. Changes from
+        before the start are not delivered.
+        """
+        with self._startLock:
+            if self._started:
+                return
+            with self.app.app_context():
+                self.lastID = self.db.session.scalar(select(func.max(WishChange.id))) or 0
+            wishlistChanged.connect(self._localChange)
+            Thread(target=self._listen, name="change-feed", daemon=True).start()
+            self._started = True
+
+    def poll(self):
+        """
+        Read the changes committed since the last poll and wake up waiting streams.
+        """
+        with self.app.app_context():
+            changes = [
+                Change(*row)
+                for row in self.db.session.execute(
+                    select(WishChange.id, WishChange.listSlug, WishChange.wishId, WishChange.kind)
+                    .where(WishChange.id > self.lastID)
+                    .order_by(WishChange.id)
+                )
+            ]
+        if not changes:
+            return
+
+        with self._condition:
+            self._changes.extend(changes)
+            self.lastID = changes[-1].id
+            self._condition.notify_all()
+
+    def waitForChanges(self, listSlug: str, afterID: int, timeout: float):
+        """
+        Wait until there are changes to a list after the given change.
+
+        Args:
+            listSlug (str): the list to wait for
+            afterID (int): ID of the last change the caller has seen
+            timeout (float): maximum number of seconds to wait
+
+        Returns:
+            the new changes of the list, or None if they are no longer buffered,
+            and the ID to wait after next time
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.lastID > afterID, timeout)
+            oldestKnownID = self._changes[0].id - 1 if self._changes else self.lastID
+            if afterID < oldestKnownID:
+                return None, self.lastID
+            changes = [
+                change
+                for change in self._changes
+                if change.id > afterID and change.listSlug == listSlug
+            ]
+            return changes, self.lastID
+
+    def stream(self, listSlug: str, afterID: int | None = None, noSpoiler: bool = False):
+        """
+        Server-Sent Events for the changes to a list. Has no need for an app
+        context, so no database connection is held while it runs.
+
+        Args:
+            listSlug (str): the list to send changes of
+            afterID (int, optional): ID of the last change the client has seen,
+                from its Last-Event-ID header. Defaults to None, only send new changes.
+            noSpoiler (bool, optional): leave out changes that reveal whether a
+                wish was fulfilled. Defaults to False.
+
+        Yields:
+            the events, as text
+        """
+        if afterID is None or afterID > self.lastID:
+            afterID = self.lastID
+        yield f"retry: {KEEPALIVE_SECONDS * 1000}\n\n"
+        while True:
+            changes, afterID = self.waitForChanges(listSlug, afterID, KEEPALIVE_SECONDS)
+            if changes is None:
+                # Missed changes, the client has to load the whole page again
+                yield f"id: {afterID}\nevent: reload\ndata: {{}}\n\n"
+                continue
+            sent = False
+            for change in changes:
+                if noSpoiler and change.kind in SPOILER_KINDS:
+                    continue
+                data = json.dumps({"kind": change.kind, "wish": change.wishId})
+                yield f"id: {change.id}\nevent: change\ndata: {data}\n\n"
+                sent = True
+            if not sent:
+                yield ": keepalive\n\n"
+
+    def _localChange(self, sender, **extra):
+        self._wakeup.set()
+
+    def _listen(self):
+        while True:
+            self._wakeup.wait(self.app.config["CHANGE_POLL_SECONDS"])
+            self._wakeup.clear()
+            try:
+                self.poll()
+            except Exception:
+                self.app.logger.exception("Reading wishlist changes failed")
@@ -0,0 +1,309 @@
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Connection, Engine, event, inspect
+from sqlalchemy.orm import DeclarativeBase
+
+# Config keys and the pragma they set on every new SQLite connection.
+# busy_timeout comes first so switching the journal mode waits for other workers.
+# auto_vacuum only has an effect on new databases, before they switch to WAL.
+SQLITE_PRAGMAS = {
+    "SQLITE_BUSY_TIMEOUT": "busy_timeout",
+    "SQLITE_AUTO_VACUUM": "auto_vacuum",
+    "SQLITE_JOURNAL_MODE": "journal_mode",
+    "SQLITE_SYNCHRONOUS": "synchronous",
+    "SQLITE_CACHE_SIZE": "cache_size",
+    "SQLITE_MMAP_SIZE": "mmap_size",
+}
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+# Sessions live as long as the request. Wishes are still up to date after a
+# commit, so they don't need to be loaded again for the rest of the request.
+db = SQLAlchemy(model_class=Base, session_options={"expire_on_commit": False})
+
+
+def _nullableUniqueSecret(connection: Connection):
+    # SQLite can't change a column's constraints in place, so the table is rebuilt.
+    connection.exec_driver_sql(
+        """
+        CREATE TABLE wishes_new (
+            id INTEGER NOT NULL,
+            title VARCHAR NOT NULL,
+            priority INTEGER NOT NULL,
+            "desc" VARCHAR NOT NULL,
+            link VARCHAR NOT NULL,
+            endless BOOLEAN NOT NULL,
+            giver VARCHAR NOT NULL,
+            secret VARCHAR,
+            deleted DATETIME,
+            PRIMARY KEY (id)
+        )
+        """
+    )
+    connection.exec_driver_sql(
+        """
+        INSERT INTO wishes_new (id, title, priority, "desc", link, endless, giver, secret, deleted)
+        SELECT id, title, priority, "desc", link, endless, giver, NULLIF(secret, ''), deleted
+        FROM wishes
+        """
+    )
+    connection.exec_driver_sql("DROP TABLE wishes")
+    connection.exec_driver_sql("ALTER TABLE wishes_new RENAME TO wishes")
+    connection.exec_driver_sql("CREATE UNIQUE INDEX ix_wishes_secret ON wishes (secret)")
+
+
+def _listOrderIndex(connection: Connection):
+    connection.exec_driver_sql(
+        "CREATE INDEX ix_wishes_deleted_giver_priority ON wishes (deleted, giver, priority)"
+    )
+
+
+def _listSlug(connection: Connection):
+    connection.exec_driver_sql(
+        """ALTER TABLE wishes ADD COLUMN "listSlug" VARCHAR NOT NULL DEFAULT ''"""
+    )
+    connection.exec_driver_sql("DROP INDEX ix_wishes_deleted_giver_priority")
+    connection.exec_driver_sql(
+        'CREATE INDEX ix_wishes_list_deleted_giver_priority ON wishes ("listSlug", deleted, giver, priority)'
+    )
+
+
+def _searchIndex(connection: Connection):
+    # External content FTS5 table over title and description. The triggers keep
+    # it in sync with every write to wishes, whichever code path makes it.
+    connection.exec_driver_sql(
+        """
+        CREATE VIRTUAL TABLE wishes_fts USING fts5(
+            title, "desc", content='wishes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    connection.exec_driver_sql(
+        """
+        CREATE TRIGGER wishes_fts_insert AFTER INSERT ON wishes BEGIN
+            INSERT INTO wishes_fts (rowid, title, "desc") VALUES (new.id, new.title, new."desc");
+        END
+        """
+    )
+    connection.exec_driver_sql(
+        """
+        CREATE TRIGGER wishes_fts_delete AFTER DELETE ON wishes BEGIN
+            INSERT INTO wishes_fts (wishes_fts, rowid, title, "desc")
+            VALUES ('delete', old.id, old.title, old."desc");
+        END
+        """
+    )
+    connection.exec_driver_sql(
+        """
+        CREATE TRIGGER wishes_fts_update AFTER UPDATE OF title, "desc" ON wishes BEGIN
+            INSERT INTO wishes_fts (wishes_fts, rowid, title, "desc")
+            VALUES ('delete', old.id, old.title, old."desc");
+            INSERT INTO wishes_fts (rowid, title, "desc") VALUES (new.id, new.title, new."desc");
+        END
+        """
+    )
+    connection.exec_driver_sql("INSERT INTO wishes_fts (wishes_fts) VALUES ('rebuild')")
+
+
+def _wishChanges(connection: Connection):
+    connection.exec_driver_sql(
+        """
+        CREATE TABLE wish_changes (
+            id INTEGER NOT NULL,
+            "listSlug" VARCHAR NOT NULL,
+            "wishId" INTEGER,
+            kind VARCHAR NOT NULL,
+            created DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """
+    )
+
+
+def _changeJournal(connection: Connection):
+    connection.exec_driver_sql("ALTER TABLE wish_changes ADD COLUMN data JSON")
+    connection.exec_driver_sql(
+        'CREATE INDEX ix_wish_changes_list_id ON wish_changes ("listSlug", id)'
+    )
+
+
+def _wishStatus(connection: Connection):
+    connection.exec_driver_sql(
+        'ALTER TABLE wishes ADD COLUMN status INTEGER DEFAULT 0 NOT NULL'
+    )
+    # Values of wishes.STATUS_OPEN, STATUS_FULFILLED and STATUS_DELETED
+    connection.exec_driver_sql(
+        """
+        UPDATE wishes SET status = CASE
+            WHEN deleted IS NOT NULL THEN 2
+            WHEN giver != '' THEN 1
+            ELSE 0
+        END
+        """
+    )
+    connection.exec_driver_sql(
+        'CREATE INDEX ix_wishes_list_status_priority ON wishes ("listSlug", status, priority DESC, id)'
+    )
+    # Replaced by the status index
+    connection.exec_driver_sql("DROP INDEX ix_wishes_list_deleted_giver_priority")
+
+
+def _maintenanceTables(connection: Connection):
+    connection.exec_driver_sql(
+        """
+        CREATE TABLE wishes_archive (
+            id INTEGER NOT NULL,
+            "listSlug" VARCHAR NOT NULL,
+            title VARCHAR NOT NULL,
+            priority INTEGER NOT NULL,
+            "desc" VARCHAR NOT NULL,
+            link VARCHAR NOT NULL,
+            endless BOOLEAN NOT NULL,
+            giver VARCHAR NOT NULL,
+            secret VARCHAR,
+            deleted DATETIME NOT NULL,
+            archived DATETIME NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """
+    )
+    connection.exec_driver_sql(
+        """
+        CREATE TABLE job_runs (
+            name VARCHAR NOT NULL,
+            "lastRun" DOUBLE NOT NULL,
+            "lastResult" JSON,
+            PRIMARY KEY (name)
+        )
+        """
+    )
+
+
+def _wishIDsNotReused(connection: Connection):
+    # Without AUTOINCREMENT SQLite hands out the ID of the newest wish again once
+    # it is archived, which would clash in wishes_archive and the change journal.
+    # Dropping wishes drops the search triggers as well, so the index is rebuilt.
+    connection.exec_driver_sql("DROP TABLE wishes_fts")
+    connection.exec_driver_sql(
+        """
+        CREATE TABLE wishes_new (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            title VARCHAR NOT NULL,
+            priority INTEGER NOT NULL,
+            "desc" VARCHAR NOT NULL,
+            link VARCHAR NOT NULL,
+            endless BOOLEAN NOT NULL,
+            giver VARCHAR NOT NULL,
+            secret VARCHAR,
+            deleted DATETIME,
+            "listSlug" VARCHAR DEFAULT '' NOT NULL,
+            status INTEGER DEFAULT 0 NOT NULL
+        )
+        """
+    )
+    connection.exec_driver_sql(
+        """
+        INSERT INTO wishes_new (id, title, priority, "desc", link, endless, giver, secret, deleted, "listSlug", status)
+        SELECT id, title, priority, "desc", link, endless, giver, secret, deleted, "listSlug", status
+        FROM wishes
+        """
+    )
+    connection.exec_driver_sql("DROP TABLE wishes")
+    connection.exec_driver_sql("ALTER TABLE wishes_new RENAME TO wishes")
+    connection.exec_driver_sql("CREATE UNIQUE INDEX ix_wishes_secret ON wishes (secret)")
+    connection.exec_driver_sql(
+        'CREATE INDEX ix_wishes_list_status_priority ON wishes ("listSlug", status, priority DESC, id)'
+    )
+    _searchIndex(connection)
+    # Archived wishes and the journal may know higher IDs than the remaining wishes
+    connection.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'wishes'")
+    connection.exec_driver_sql(
+        """
+        INSERT INTO sqlite_sequence (name, seq) SELECT 'wishes', MAX(
+            COALESCE((SELECT MAX(id) FROM wishes), 0),
+            COALESCE((SELECT MAX(id) FROM wishes_archive), 0),
+            COALESCE((SELECT MAX("wishId") FROM wish_changes), 0)
+        )
+        """
+    )
+
+
+# Schema objects create_all doesn't know about, created for new databases as well
+SQLITE_SCHEMA_EXTRAS = [
+    _searchIndex,
+]
+
+# Append only: a database at user_version n has had the first n migrations applied.
+MIGRATIONS = [
+    _nullableUniqueSecret,
+    _listOrderIndex,
+    _listSlug,
+    _searchIndex,
+    _wishChanges,
+    _changeJournal,
+    _wishStatus,
+    _maintenanceTables,
+    _wishIDsNotReused,
+]
+
+
+def configureSqlite(engine: Engine, config):
+    """
+    Apply the SQLITE_* config values as pragmas to every connection the engine opens.
+    Keys that are missing or empty leave SQLite's default in place.
+
+    Args:
+        engine (Engine): the engine to configure
+        config (dict): app config
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = []
+    for key, pragma in SQLITE_PRAGMAS.items():
+        value = config.get(key)
+        if value is None or value == "":
+            continue
+        if not str(value).lstrip("-").isalnum():
+            raise ValueError(f"Invalid value for {key}: {value!r}")
+        pragmas.append(f"PRAGMA {pragma} = {value}")
+
+    @event.listens_for(engine, "connect")
+    def setPragmas(dbapiConnection, connectionRecord):
+        cursor = dbapiConnection.cursor()
+        for statement in pragmas:
+            cursor.execute(statement)
+        cursor.close()
+
+
+def migrate(db):
+    """
+    Create the schema for a new database or bring an existing one up to date.
+    Has to be called within the app.app_context().
+
+    The schema version is kept in SQLite's user_version pragma. Migrations run
+    in one write transaction, so concurrently starting workers wait for each
+    other instead of migrating twice.
+
+    Args:
+        db (SQLAlchemy): the database to migrate
+    """
+    if db.engine.dialect.name != "sqlite":
+        db.create_all()
+        return
+
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        if not inspect(connection).has_table("wishes"):
+            db.metadata.create_all(connection)
+            for createExtra in SQLITE_SCHEMA_EXTRAS:
+                createExtra(connection)
+            version = len(MIGRATIONS)
+        else:
+            for migration in MIGRATIONS[version:]:
+                migration(connection)
+                version += 1
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")
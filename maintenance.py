@@ -0,0 +1,230 @@
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from typing import Callable
+
+from flask import Flask
+from sqlalchemy import JSON, delete, func, insert, select, update
+from sqlalchemy.orm import Mapped, mapped_column
+
+from database import db
+from wishes import WishChange
+
+# How often the scheduler checks whether a job is due
+SCHEDULER_TICK_SECONDS = 60
+# Pause between archival batches and vacuum steps, so other writers get the lock
+MAINTENANCE_PAUSE_SECONDS = 0.05
+# Pages freed per incremental vacuum step
+VACUUM_STEP_PAGES = 1000
+# Rows ANALYZE looks at per index, keeps it fast on big tables
+ANALYSIS_LIMIT = 1000
+
+
+class JobRun(db.Model):
+    """When a scheduled job last ran, shared by all processes."""
+
+    __tablename__ = "job_runs"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    # Seconds since the epoch
+    lastRun: Mapped[float]
+    # What the job returned the last time it ran
+    lastResult: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+
+
+class Scheduler:
+    def __init__(self, app: Flask, db):
+        """
+        Runs jobs in a background thread at fixed intervals. Every worker process
+        runs a scheduler, but a job is claimed in the job_runs table before it
+        runs, so only one of them runs it each time it is due.
+
+        Args:
+            app (Flask): the app
+            db (SQLAlchemy): the database
+        """
+        self.app = app
+        self.db = db
+        # (name, interval in seconds, job)
+        self.jobs = []
+        self._startLock = Lock()
+        self._started = False
+
+    def add(self, name: str, intervalSeconds: float, job: Callable[[], object]):
+        """
+        Args:
+            name (str): unique name of the job
+            intervalSeconds (float): how often to run it, 0 never runs it
+            job (Callable[[], object]): called without arguments within an app
+                context, returns a JSON serializable result to keep in job_runs
+        """
+        if intervalSeconds > 0:
+            self.jobs.append((name, intervalSeconds, job))
+
+    def start(self):
+        """Start the scheduler thread, unless it is running already or there are no jobs."""
+        with self._startLock:
+            if self._started or not self.jobs:
+                return
+            Thread(target=self._run, name="scheduler", daemon=True).start()
+            self._started = True
+
+    def runDue(self):
+        """Run the jobs that are due and not claimed by another process."""
+        for name, intervalSeconds, job in self.jobs:
+            with self.app.app_context():
+                if not self._claim(name, intervalSeconds):
+                    continue
+                try:
+                    result = job()
+                except Exception as e:
+                    self.app.logger.exception("Scheduled job %s failed", name)
+                    result = {"error": str(e)}
+                self.db.session.rollback()
+                self.db.session.execute(
+                    update(JobRun).where(JobRun.name == name).values(lastResult=result)
+                )
+                self.db.session.commit()
+
+    def getRuns(self):
+        """
+        Has to be called within the app.app_context().
+
+        Returns:
+            dict of job name to when it last ran and what it returned
+        """
+        return {
+            run.name: {
+                "lastRun": datetime.fromtimestamp(run.lastRun).isoformat() if run.lastRun else None,
+                "result": run.lastResult,
+            }
+            for run in self.db.session.scalars(select(JobRun).order_by(JobRun.name))
+        }
+
+    def _claim(self, name: str, intervalSeconds: float):
+        now = time()
+        session = self.db.session
+        lastRun = session.scalar(select(JobRun.lastRun).where(JobRun.name == name))
+        if lastRun is None:
+            session.execute(insert(JobRun).prefix_with("OR IGNORE"), {"name": name, "lastRun": 0})
+        elif lastRun > now - intervalSeconds:
+            session.rollback()
+            return False
+        # Only one process gets to update the row for this run
+        claimed = session.execute(
+            update(JobRun)
+            .where((JobRun.name == name) & (JobRun.lastRun <= now - intervalSeconds))
+            .values(lastRun=now)
+        ).rowcount
+        session.commit()
+        return claimed == 1
+
+    def _run(self):
+        while True:
+            try:
+                self.runDue()
+            except Exception:
+                self.app.logger.exception("Running scheduled jobs failed")
+            sleep(SCHEDULER_TICK_SECONDS)
+
+
+class Maintenance:
+    def __init__(self, app: Flask, db, wishlists: dict):
+        """
+        Archives wishes deleted longer than DELETED_RETENTION_DAYS ago, deletes
+        changes older than CHANGE_RETENTION_HOURS from the journal, gives the
+        freed space back to the file system and updates the query planner's
+        statistics. Every step is a short transaction, so requests only ever
+        wait for one of them.
+
+        Args:
+            app (Flask): the app
+            db (SQLAlchemy): the database
+            wishlists (dict): the Wishlist of every list by slug
+        """
+        self.app = app
+        self.db = db
+        self.wishlists = wishlists
+
+    def run(self):
+        """
+        Run all maintenance steps. Has to be called within the app.app_context().
+
+        Returns:
+            dict with what was archived and reclaimed
+        """
+        started = monotonic()
+        report = {"started": datetime.now().isoformat(), "archivedWishes": 0, "prunedChanges": 0}
+
+        retentionDays = self.app.config["DELETED_RETENTION_DAYS"]
+        if retentionDays:
+            deletedBefore = datetime.now() - timedelta(days=retentionDays)
+            for wishlist in self.wishlists.values():
+                while archived := wishlist.archiveDeleted(deletedBefore):
+                    report["archivedWishes"] += archived
+                    sleep(MAINTENANCE_PAUSE_SECONDS)
+
+        retentionHours = self.app.config["CHANGE_RETENTION_HOURS"]
+        if retentionHours:
+            report["prunedChanges"] = self.__pruneChanges(
+                datetime.now() - timedelta(hours=retentionHours)
+            )
+
+        if self.db.engine.dialect.name == "sqlite":
+            report.update(self.__vacuum())
+            self.__analyze()
+        report["seconds"] = round(monotonic() - started, 3)
+
+        self.app.logger.info(
+            "Maintenance: archived %d deleted wishes, freed %d bytes in %.1f s",
+            report["archivedWishes"],
+            report.get("freedBytes", 0),
+            report["seconds"],
+        )
+        return report
+
+    def __pruneChanges(self, createdBefore: datetime):
+        # The newest row of every list is kept: it is the list's version, see
+        # Wishlist.version, and IDs are never handed out a second time
+        newestPerList = select(func.max(WishChange.id)).group_by(WishChange.listSlug)
+        pruned = self.db.session.execute(
+            delete(WishChange).where(
+                (WishChange.created < createdBefore) & WishChange.id.not_in(newestPerList)
+            )
+        ).rowcount
+        self.db.session.commit()
+        return pruned
+
+    def __pragma(self, connection, pragma: str):
+        return connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+
+    def __vacuum(self):
+        """
+        Give free pages back to the file system, a step at a time. Only possible
+        if the database was created with auto_vacuum = INCREMENTAL.
+        """
+        with self.db.engine.connect() as connection:
+            pageSize = self.__pragma(connection, "page_size")
+            pagesBefore = self.__pragma(connection, "page_count")
+            freePages = self.__pragma(connection, "freelist_count")
+            if self.__pragma(connection, "auto_vacuum") == 2:
+                while self.__pragma(connection, "freelist_count"):
+                    # execute only steps the pragma once, freeing a single page.
+                    # executescript runs it to the end.
+                    connection.connection.driver_connection.executescript(
+                        f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})"
+                    )
+                    connection.commit()
+                    sleep(MAINTENANCE_PAUSE_SECONDS)
+            pagesAfter = self.__pragma(connection, "page_count")
+        return {
+            "freePages": freePages,
+            "freedBytes": (pagesBefore - pagesAfter) * pageSize,
+            "sizeBytes": pagesAfter * pageSize,
+        }
+
+    def __analyze(self):
+        with self.db.engine.connect() as connection:
+            connection.exec_driver_sql(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+            connection.exec_driver_sql("ANALYZE")
+            connection.commit()
@@ -0,0 +1,179 @@
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from time import perf_counter
+
+from flask import Flask, before_render_template, has_request_context, request
+from flask import template_rendered
+from sqlalchemy import Engine, event
+
+# Request environ key of the measurements for the current request. Not kept in g,
+# as Wishlist calls run in app contexts of their own.
+REQUEST_METRICS_KEY = "wishlist.metrics"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+class RequestMetrics:
+    __slots__ = ("start", "sqlQueries", "sqlSeconds", "templateSeconds", "templateStart")
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.sqlQueries = 0
+        self.sqlSeconds = 0.0
+        self.templateSeconds = 0.0
+        self.templateStart = None
+
+
+def _currentRequestMetrics():
+    if not has_request_context():
+        return None
+    return request.environ.get(REQUEST_METRICS_KEY)
+
+
+class Metrics:
+    def __init__(self, app: Flask, engine: Engine, renderCache=None):
+        """
+        Collects per-request timings, SQL statement counts and durations,
+        template render times and render cache hit rates for this process.
+
+        Requests slower than the SLOW_REQUEST_SECONDS config value are logged
+        as warnings, 0 disables the log.
+
+        Args:
+            app (Flask): the app to instrument
+            engine (Engine): the engine whose statements are counted
+            renderCache (RenderCache, optional): cache to report hits and misses of
+        """
+        self.app = app
+        self.renderCache = renderCache
+        self._lock = Lock()
+        self.requestDurations = defaultdict(Histogram)
+        self.sqlQueries = defaultdict(int)
+        self.sqlSeconds = defaultdict(float)
+        self.templateDurations = defaultdict(Histogram)
+
+        app.before_request(self._beforeRequest)
+        app.teardown_request(self._teardownRequest)
+        before_render_template.connect(self._beforeRenderTemplate, app)
+        template_rendered.connect(self._templateRendered, app)
+        event.listen(engine, "before_cursor_execute", self._beforeCursorExecute)
+        event.listen(engine, "after_cursor_execute", self._afterCursorExecute)
+
+    def _beforeRequest(self):
+        request.environ[REQUEST_METRICS_KEY] = RequestMetrics()
+
+    def _teardownRequest(self, exception):
+        measured = _currentRequestMetrics()
+        if measured is None:
+            return
+        duration = perf_counter() - measured.start
+        endpoint = request.endpoint or "unmatched"
+        labels = f'endpoint="{endpoint}",method="{request.method}"'
+        with self._lock:
+            self.requestDurations[labels].observe(duration)
+            self.sqlQueries[labels] += measured.sqlQueries
+            self.sqlSeconds[labels] += measured.sqlSeconds
+
+        slowRequestSeconds = self.app.config.get("SLOW_REQUEST_SECONDS")
+        if slowRequestSeconds and duration >= slowRequestSeconds:
+            self.app.logger.warning(
+                "Slow request: %s %s took %.0f ms (%d SQL statements in %.0f ms, templates %.0f ms)",
+                request.method,
+                request.full_path.rstrip("?"),
+                duration * 1000,
+                measured.sqlQueries,
+                measured.sqlSeconds * 1000,
+                measured.templateSeconds * 1000,
+            )
+
+    def _beforeRenderTemplate(self, app, template, context, **extra):
+        measured = _currentRequestMetrics()
+        if measured is not None:
+            measured.templateStart = perf_counter()
+
+    def _templateRendered(self, app, template, context, **extra):
+        measured = _currentRequestMetrics()
+        if measured is None or measured.templateStart is None:
+            return
+        duration = perf_counter() - measured.templateStart
+        measured.templateStart = None
+        measured.templateSeconds += duration
+        with self._lock:
+            self.templateDurations[f'template="{template.name}"'].observe(duration)
+
+    def _beforeCursorExecute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metricsQueryStart", []).append(perf_counter())
+
+    def _afterCursorExecute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = perf_counter() - conn.info["metricsQueryStart"].pop()
+        # Statements outside of requests (startup, maintenance) aren't attributed
+        measured = _currentRequestMetrics()
+        if measured is not None:
+            measured.sqlQueries += 1
+            measured.sqlSeconds += duration
+
+    def render(self):
+        """
+        Returns:
+            all metrics in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP wishlist_request_duration_seconds Time spent handling requests.",
+            "# TYPE wishlist_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            for labels, histogram in sorted(self.requestDurations.items()):
+                lines.extend(histogram.lines("wishlist_request_duration_seconds", labels))
+            lines += [
+                "# HELP wishlist_sql_queries_total SQL statements executed while handling requests.",
+                "# TYPE wishlist_sql_queries_total counter",
+            ]
+            for labels, count in sorted(self.sqlQueries.items()):
+                lines.append(f"wishlist_sql_queries_total{{{labels}}} {count}")
+            lines += [
+                "# HELP wishlist_sql_duration_seconds_total Time spent in SQL statements while handling requests.",
+                "# TYPE wishlist_sql_duration_seconds_total counter",
+            ]
+            for labels, seconds in sorted(self.sqlSeconds.items()):
+                lines.append(f"wishlist_sql_duration_seconds_total{{{labels}}} {seconds}")
+            lines += [
+                "# HELP wishlist_template_render_seconds Time spent rendering templates.",
+                "# TYPE wishlist_template_render_seconds histogram",
+            ]
+            for labels, histogram in sorted(self.templateDurations.items()):
+                lines.extend(histogram.lines("wishlist_template_render_seconds", labels))
+
+        if self.renderCache is not None:
+            lines += [
+                "# HELP wishlist_render_cache_hits_total Pages served from the render cache.",
+                "# TYPE wishlist_render_cache_hits_total counter",
+                f"wishlist_render_cache_hits_total {self.renderCache.hits}",
+                "# HELP wishlist_render_cache_misses_total Pages that had to be rendered.",
+                "# TYPE wishlist_render_cache_misses_total counter",
+                f"wishlist_render_cache_misses_total {self.renderCache.misses}",
+                "# HELP wishlist_render_cache_entries Pages currently in the render cache.",
+                "# TYPE wishlist_render_cache_entries gauge",
+                f"wishlist_render_cache_entries {len(self.renderCache)}",
+            ]
+        return "\n".join(lines) + "\n"
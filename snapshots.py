@@ -0,0 +1,155 @@
+import fcntl
+import os
+import tempfile
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from flask import Flask
+from sqlalchemy import func, select
+
+from wishes import WishChange, wishlistChanged
+
+# Snapshot file of each view, relative to the list's directory
+SNAPSHOT_FILES = {False: "index.html", True: "no-spoiler.html"}
+# Journal version the snapshots of a list were rendered at
+VERSION_FILE = ".version"
+# Values of the view cookie, see viewCookieName
+VIEW_SNAPSHOT = "no-spoiler"
+VIEW_DYNAMIC = "dynamic"
+
+
+def viewCookieName(listSlug: str):
+    """
+    Name of the cookie telling the web server which snapshot a visitor of a list
+    can get: none for the normal view, VIEW_SNAPSHOT for the spoiler-free view,
+    VIEW_DYNAMIC if the page has to come from the app. Only uses characters
+    nginx allows in $cookie_ variables.
+    """
+    return "wishlist_view" + (f"_{listSlug.replace('-', '_')}" if listSlug else "")
+
+
+def snapshotDirectory(directory: str, listSlug: str):
+    return os.path.join(directory, listSlug) if listSlug else directory
+
+
+def _writeAtomically(path: str, content: str):
+    handle, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as f:
+            f.write(content)
+        # mkstemp only allows the owner to read, the web server has to as well
+        os.chmod(temporaryPath, 0o644)
+        os.replace(temporaryPath, path)
+    except BaseException:
+        os.unlink(temporaryPath)
+        raise
+
+
+class SnapshotPublisher:
+    def __init__(
+        self,
+        app: Flask,
+        db,
+        wishlists: dict,
+        directory: str,
+        renderPage: Callable[[str, bool], str],
+    ):
+        """
+        Writes the list pages anonymous visitors get to SNAPSHOT_DIR whenever a
+        wishlist changes, so the web server can serve them without the app.
+
+        Changes made in this process are published by a background thread.
+        Every process publishes its own changes; the journal version stored
+        next to the snapshots keeps a slow process from replacing newer
+        snapshots with older ones.
+
+        Args:
+            app (Flask): the app
+            db (SQLAlchemy): the database
+            wishlists (dict): the Wishlist of every list by slug
+            directory (str): where to write the snapshots
+            renderPage (Callable[[str, bool], str]): renders the page of a list
+                for an anonymous visitor, called with the list slug and whether
+                it is the spoiler-free view
+        """
+        self.app = app
+        self.db = db
+        self.wishlists = wishlists
+        self.directory = directory
+        self.renderPage = renderPage
+        self._pending = set()
+        self._pendingLock = Lock()
+        self._wakeup = Event()
+        self._startLock = Lock()
+        self._started = False
+        wishlistChanged.connect(self._localChange)
+
+    def publishAll(self):
+        """Write the snapshots of all lists right away."""
+        for listSlug in self.wishlists:
+            self.publish(listSlug)
+
+    def publish(self, listSlug: str):
+        """
+        Render the snapshots of a list and replace the ones on disk, unless
+        they are newer already.
+
+        Args:
+            listSlug (str): the list to publish
+        """
+        with self.app.app_context():
+            version = self.db.session.scalar(select(func.max(WishChange.id))) or 0
+            pages = {
+                filename: self.renderPage(listSlug, noSpoiler)
+                for noSpoiler, filename in SNAPSHOT_FILES.items()
+            }
+
+        directory = snapshotDirectory(self.directory, listSlug)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            versionPath = os.path.join(directory, VERSION_FILE)
+            try:
+                with open(versionPath) as f:
+                    publishedVersion = int(f.read() or 0)
+            except (FileNotFoundError, ValueError):
+                publishedVersion = -1
+            if publishedVersion > version:
+                return
+            for filename, page in pages.items():
+                _writeAtomically(os.path.join(directory, filename), page)
+            _writeAtomically(versionPath, str(version))
+
+    def publishPending(self):
+        """Publish the lists that changed since the last call."""
+        with self._pendingLock:
+            pending = self._pending
+            self._pending = set()
+        for listSlug in pending:
+            self.publish(listSlug)
+
+    def _localChange(self, sender, **extra):
+        if self.wishlists.get(sender.listSlug) is not sender:
+            # A wishlist of another app in this process
+            return
+        with self._pendingLock:
+            self._pending.add(sender.listSlug)
+        self._start()
+        self._wakeup.set()
+
+    def _start(self):
+        # Started by the first change, so the thread runs in the worker
+        # process and not in a master process it was forked from
+        with self._startLock:
+            if not self._started:
+                Thread(target=self._run, name="snapshot-publisher", daemon=True).start()
+                self._started = True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.publishPending()
+            except Exception:
+                self.app.logger.exception("Publishing snapshots failed")
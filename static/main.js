@@ -9,6 +9,38 @@ function autosizeTextarea() {
     }
 }
 
+function liveUpdates() {
+    const marker = document.querySelector('[data-events-url]');
+    if (!marker || !window.EventSource) {
+        return;
+    }
+    let refreshTimeout = null;
+    const refresh = () => {
+        // Don't replace a form the visitor is filling in
+        if (document.activeElement && document.activeElement.closest('main form')) {
+            return;
+        }
+        fetch(window.location.href, { credentials: 'same-origin' })
+            .then((response) => response.text())
+            .then((html) => {
+                const page = new DOMParser().parseFromString(html, 'text/html');
+                const main = page.querySelector('main');
+                if (main) {
+                    document.querySelector('main').replaceWith(main);
+                }
+            });
+    };
+    // Several changes in a row only cause one refresh
+    const scheduleRefresh = () => {
+        clearTimeout(refreshTimeout);
+        refreshTimeout = setTimeout(refresh, 500);
+    };
+    const events = new EventSource(marker.dataset.eventsUrl);
+    events.addEventListener('change', scheduleRefresh);
+    events.addEventListener('reload', scheduleRefresh);
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     autosizeTextarea();
+    liveUpdates();
 })
\ No newline at end of file
@@ -0,0 +1,174 @@
+import re
+import secrets
+from functools import wraps
+from typing import Callable
+
+from flask import Flask, abort, has_request_context, request
+from flask.sessions import SecureCookieSessionInterface
+
+# WSGI environ key holding the slug of the list a request is for
+LIST_ENVIRON_KEY = "wishlist.list"
+# The list configured at the top level of config.toml
+DEFAULT_LIST = ""
+
+LIST_SLUG_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]*$")
+LIST_CONFIG_DEFAULTS = {
+    "OWNER_NAME": "Jemand",
+    "THEME_HUE": 260,
+    "DESCRIPTION": None,
+    "HOST": None,
+}
+
+
+def addMissingListSecrets(configFileContents: dict):
+    """
+    Generate admin secrets for lists in the config file that don't have one yet.
+
+    Args:
+        configFileContents (dict): parsed config.toml, modified in place
+
+    Returns:
+        True if a secret was added and the config file needs to be written
+    """
+    changed = False
+    for listConfig in configFileContents.get("LISTS", {}).values():
+        if not listConfig.get("ADMIN_SECRET"):
+            listConfig["ADMIN_SECRET"] = secrets.token_hex()
+            changed = True
+    return changed
+
+
+def loadListConfigs(app: Flask):
+    """
+    Collect the settings of all lists. The default list uses the top level
+    config values, every table under LISTS in config.toml is another list.
+
+    Args:
+        app (Flask): the app, with its config already loaded
+
+    Raises:
+        ValueError: Is raised if a list slug can't be used in URLs.
+
+    Returns:
+        dict of list slug to that list's settings
+    """
+    listConfigs = {
+        DEFAULT_LIST: {
+            "OWNER_NAME": app.config["OWNER_NAME"],
+            "THEME_HUE": app.config["THEME_HUE"],
+            "DESCRIPTION": app.config.get("DESCRIPTION"),
+            "ADMIN_SECRET": app.config["ADMIN_SECRET"],
+            "HOST": None,
+        }
+    }
+    for slug, values in app.config.get("LISTS", {}).items():
+        if not LIST_SLUG_PATTERN.match(slug):
+            raise ValueError(
+                f"Invalid list name {slug!r}, only lowercase letters, digits and dashes are allowed."
+            )
+        listConfigs[slug] = LIST_CONFIG_DEFAULTS | values
+    return listConfigs
+
+
+def currentListSlug():
+    if not has_request_context():
+        return DEFAULT_LIST
+    return request.environ.get(LIST_ENVIRON_KEY, DEFAULT_LIST)
+
+
+def defaultListOnly(f: Callable):
+    """
+    Only serve a view on the default list. For pages about the whole app, like
+    the metrics, which the admins of other lists must not see.
+    """
+
+    @wraps(f)
+    def defaultListWrapper(*args, **kwds):
+        if currentListSlug() != DEFAULT_LIST:
+            abort(404)
+        return f(*args, **kwds)
+
+    return defaultListWrapper
+
+
+class ListDispatcher:
+    def __init__(self, wsgiApp, app: Flask, listConfigs: dict):
+        """
+        WSGI middleware that finds the list a request is for, either by the
+        list's HOST or by a /<list slug> path prefix. The prefix is moved to
+        SCRIPT_NAME, so routes and url_for work the same for every list.
+
+        Args:
+            wsgiApp: the wrapped WSGI app
+            app (Flask): the app, used to check list slugs against its routes
+            listConfigs (dict): settings of all lists by slug
+
+        Raises:
+            ValueError: Is raised if a list slug would hide one of the app's routes.
+        """
+        self.wsgiApp = wsgiApp
+        reservedPrefixes = {
+            rule.rule.strip("/").split("/")[0] for rule in app.url_map.iter_rules()
+        }
+        self.listsByHost = {}
+        self.listsByPath = set()
+        for slug, listConfig in listConfigs.items():
+            if slug == DEFAULT_LIST:
+                continue
+            if slug in reservedPrefixes:
+                raise ValueError(f"The list name {slug!r} is already used by a page.")
+            self.listsByPath.add(slug)
+            if listConfig.get("HOST"):
+                self.listsByHost[listConfig["HOST"].lower()] = slug
+
+    def __call__(self, environ, startResponse):
+        host = environ.get("HTTP_HOST", "").lower()
+        slug = self.listsByHost.get(host, self.listsByHost.get(host.split(":")[0]))
+        if slug is None:
+            slug = DEFAULT_LIST
+            path = environ.get("PATH_INFO", "")
+            prefix = path.split("/")[1] if path.startswith("/") else ""
+            if prefix in self.listsByPath:
+                slug = prefix
+                environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + "/" + prefix
+                environ["PATH_INFO"] = path[len(prefix) + 1 :] or "/"
+        environ[LIST_ENVIRON_KEY] = slug
+        return self.wsgiApp(environ, startResponse)
+
+
+class ListSessionInterface(SecureCookieSessionInterface):
+    """
+    Keeps a separate session cookie per list, so logging in as admin or
+    fulfilling wishes on one list doesn't show up on another.
+    """
+
+    def __init__(self, sessionlessEndpoints: set = frozenset()):
+        """
+        Args:
+            sessionlessEndpoints (set, optional): endpoints whose responses never
+                carry a session cookie. Defaults to none.
+        """
+        self.sessionlessEndpoints = sessionlessEndpoints
+
+    @property
+    def salt(self):
+        # Signed per list, so one list's cookie can't be replayed on another.
+        # The main list keeps Flask's salt and with it the existing sessions.
+        slug = currentListSlug()
+        salt = SecureCookieSessionInterface.salt
+        return f"{salt}-{slug}" if slug else salt
+
+    def get_cookie_name(self, app):
+        slug = currentListSlug()
+        name = super().get_cookie_name(app)
+        return f"{name}-{slug}" if slug else name
+
+    def get_cookie_path(self, app):
+        if has_request_context() and request.script_root:
+            return request.script_root
+        return super().get_cookie_path(app)
+
+    def save_session(self, app, session, response):
+        if has_request_context() and request.endpoint in self.sessionlessEndpoints:
+            return
+        super().save_session(app, session, response)
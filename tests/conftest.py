@@ -0,0 +1,46 @@
+# Temporarily add parent folder to python path so we can import app
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from app import create_app
+
+TEST_CONFIG = {
+    "TESTING": True,
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "SECRET_KEY": "test",
+    "ADMIN_SECRET": "test",
+    # No listener thread, tests only have one process
+    "CHANGE_POLL_SECONDS": 0,
+    "MAINTENANCE_INTERVAL_HOURS": 0,
+    # Tests that need backups give them a temporary directory
+    "BACKUP_DIR": "",
+}
+
+
+@pytest.fixture
+def makeApp():
+    """
+    Factory for more apps, e.g. to act as a second worker on the same database.
+    Called with config values to use on top of the test config.
+    """
+
+    def makeApp(**config):
+        return create_app(TEST_CONFIG | config)
+
+    return makeApp
+
+
+@pytest.fixture
+def app(makeApp):
+    """An app with an empty in-memory database, with its app context pushed."""
+    app = makeApp()
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
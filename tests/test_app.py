@@ -0,0 +1,443 @@
+import re
+from io import BytesIO
+
+import pytest
+
+import wishes
+from database import db
+from wishes import BatchOperationError, WishFulfilledError
+
+
+def test_appsDoNotShareWishes(app, client, makeApp):
+    app.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    otherApp = makeApp()
+
+    assert "Weltfrieden" in client.get("/").get_data(as_text=True)
+    assert "Weltfrieden" not in otherApp.test_client().get("/").get_data(as_text=True)
+
+
+def test_cachedListPageChangesWithWishlist(app, client):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    renderCache = app.extensions["wishlist"].renderCache
+    wishlist.addWish("Weltfrieden", 5)
+    client.get("/").get_data()
+    client.get("/").get_data()
+    assert renderCache.hits == 1
+
+    wishlist.addWish("Shenanigans", 3)
+    assert "Shenanigans" in client.get("/").get_data(as_text=True)
+
+
+def test_cachedListPageChangesWithOtherWorkersWishlist(makeApp, tmp_path):
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}"}
+    worker, otherWorker = makeApp(**config), makeApp(**config)
+    client = worker.test_client()
+    assert "Weltfrieden" not in client.get("/").get_data(as_text=True)
+
+    otherWorker.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    assert "Weltfrieden" in client.get("/").get_data(as_text=True)
+
+
+def test_pageChangedWhileStreamingIsNotCached(makeApp, tmp_path):
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}"}
+    worker, otherWorker = makeApp(**config), makeApp(**config)
+    worker.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    renderCache = worker.extensions["wishlist"].renderCache
+    client = worker.test_client()
+
+    # The page is rendered lazily, while the other worker commits
+    response = client.get("/")
+    otherWorker.extensions["wishlist"].wishlists[""].addWish("Shenanigans", 3)
+    response.get_data()
+    assert len(renderCache) == 0
+
+    client.get("/").get_data()
+    assert len(renderCache) == 1
+
+
+def test_conditionalGetUntilWishlistChanges(app, client):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wishlist.addWish("Weltfrieden", 5)
+    etag = client.get("/").headers["ETag"]
+
+    notModified = client.get("/", headers={"If-None-Match": etag})
+    assert notModified.status_code == 304
+    assert notModified.get_data() == b""
+
+    wishlist.addWish("Shenanigans", 3)
+    changed = client.get("/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_workersAgreeOnETag(makeApp, tmp_path):
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}"}
+    worker, otherWorker = makeApp(**config), makeApp(**config)
+    worker.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    etag = worker.test_client().get("/").headers["ETag"]
+
+    assert otherWorker.test_client().get("/", headers={"If-None-Match": etag}).status_code == 304
+    otherWorker.extensions["wishlist"].wishlists[""].addWish("Shenanigans", 3)
+    assert worker.test_client().get("/", headers={"If-None-Match": etag}).status_code == 200
+
+
+
+@pytest.mark.parametrize("setting", [{"OWNER_NAME": "Bob"}, {"THEME_HUE": 120}])
+def test_settingsChangeETag(makeApp, tmp_path, setting):
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}"}
+    before, afterDeploy = makeApp(**config), makeApp(**config, **setting)
+    before.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    etag = before.test_client().get("/").headers["ETag"]
+
+    assert afterDeploy.test_client().get("/", headers={"If-None-Match": etag}).status_code == 200
+    assert afterDeploy.extensions["wishlist"].fingerprint != before.extensions["wishlist"].fingerprint
+
+
+@pytest.mark.parametrize("format", ["jsonl", "csv"])
+def test_exportImportRoundTrip(app, client, makeApp, format):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wishlist.addWish("Weltfrieden", 5, desc="Für alle, mit \"Anführungszeichen\",\nund Zeilen")
+    wishlist.addWish("Bücher", 3, link="https://example.com", endless=True)
+    wishlist.markFulfilled(wishlist.addWish("Shenanigans", 2).id, "Tante")
+    wishlist.delWish(wishlist.addWish("Alt", 1).id)
+    client.get("/login/test")
+    exported = client.get(f"/admin/export.{format}").get_data()
+
+    otherApp = makeApp()
+    otherClient = otherApp.test_client()
+    otherClient.get("/login/test")
+    response = otherClient.post(
+        "/admin/import",
+        data={"file": (BytesIO(exported), f"wishes.{format}")},
+        content_type="multipart/form-data",
+    )
+    assert "4 Wünsche importiert." in response.get_data(as_text=True)
+
+    def fields(wishlist):
+        return [
+            {key: value for key, value in record.items() if key != "id"}
+            for record in wishlist.exportAll()
+        ]
+
+    with otherApp.app_context():
+        imported = fields(otherApp.extensions["wishlist"].wishlists[""])
+    assert imported == fields(wishlist)
+
+
+def test_importRejectsInvalidFileAsAWhole(app, client):
+    client.get("/login/test")
+    response = client.post(
+        "/admin/import",
+        data={"file": (BytesIO(b'{"title": "Gut", "priority": 3}\n[1, 2]\n'), "wishes.jsonl")},
+        content_type="multipart/form-data",
+    )
+    assert "Import fehlgeschlagen" in response.get_data(as_text=True)
+    assert list(app.extensions["wishlist"].wishlists[""].exportAll()) == []
+
+
+def test_adminPagesThroughDeletedWishes(makeApp):
+    app = makeApp(DELETED_WISHES_PAGE_SIZE=2)
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    for title in ["Eins", "Zwei", "Drei", "Vier", "Fünf"]:
+        wishlist.delWish(wishlist.addWish(title, 3).id)
+    client = app.test_client()
+    client.get("/login/test")
+
+    pages = []
+    deletedBefore = None
+    while True:
+        query = f"?deletedBefore={deletedBefore}" if deletedBefore else ""
+        page = client.get(f"/admin{query}").get_data(as_text=True)
+        pages.append([title for title in ["Eins", "Zwei", "Drei", "Vier", "Fünf"] if title in page])
+        match = re.search(r"deletedBefore=(\d+)", page)
+        if not match:
+            break
+        deletedBefore = match.group(1)
+    assert "Gelöschte Wünsche: 5" in page
+    # Most recently deleted first
+    assert pages == [["Vier", "Fünf"], ["Zwei", "Drei"], ["Eins"]]
+
+
+
+def test_adminPageStartsOverForStaleDeletedCursor(makeApp):
+    app = makeApp(DELETED_WISHES_PAGE_SIZE=2, LISTS={"bob": {}})
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    for title in ["Eins", "Zwei", "Drei"]:
+        wishlist.delWish(wishlist.addWish(title, 3).id)
+    restored = wishlist.undelWish(wishlist.delWish(wishlist.addWish("Wieder da", 3).id).id)
+    otherList = app.extensions["wishlist"].wishlists["bob"]
+    othersDeleted = otherList.delWish(otherList.addWish("Bobs Wunsch", 3).id)
+    client = app.test_client()
+    client.get("/login/test")
+
+    for deletedBefore in [99999, restored.id, othersDeleted.id]:
+        response = client.get(f"/admin?deletedBefore={deletedBefore}")
+        assert response.status_code == 200
+        page = response.get_data(as_text=True)
+        assert "Drei" in page and "Zwei" in page and "Eins" not in page
+
+
+def test_adminPageShowsOtherWorkersChanges(makeApp, tmp_path):
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}"}
+    worker, otherWorker = makeApp(**config), makeApp(**config)
+    client = worker.test_client()
+    client.get("/login/test")
+    assert "Wünsche gesamt: 0" in client.get("/admin").get_data(as_text=True)
+
+    otherWorker.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    page = client.get("/admin").get_data(as_text=True)
+    assert "Weltfrieden" in page and "Wünsche gesamt: 1" in page
+
+
+def fulfillWish(client, wishID, giver="Tante"):
+    """Fulfill a wish like a visitor does and return the secret."""
+    response = client.post(f"/wishes/{wishID}", data={"user_nickname": giver})
+    client.get(response.headers["Location"]).get_data()
+    return response.headers["Location"].rsplit("/", 1)[1]
+
+
+def test_giftSurvivesDeleteAndRestore(app, client):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wish = wishlist.addWish("Weltfrieden", 5)
+    fulfillWish(client, wish.id)
+    assert "(schenkst du)" in client.get("/").get_data(as_text=True)
+
+    wishlist.delWish(id=wish.id)
+    assert "Weltfrieden" not in client.get("/").get_data(as_text=True)
+    wishlist.undelWish(id=wish.id)
+    assert "(schenkst du)" in client.get("/").get_data(as_text=True)
+
+
+def test_reopenedGiftIsDroppedFromSession(app, client):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wish = wishlist.addWish("Weltfrieden", 5)
+    secret = fulfillWish(client, wish.id)
+    client.post(f"/wishes/{wish.id}/{secret}")
+
+    client.get("/").get_data()
+    with client.session_transaction() as session:
+        assert session["fulfilledWishes"] == []
+
+
+def test_apiAnswersUnauthorizedWithJson(client):
+    for response in [
+        client.get("/api/changes"),
+        client.get("/api/jobs"),
+        client.post("/api/wishes/batch", json={"operations": []}),
+    ]:
+        assert response.status_code == 401
+        assert "error" in response.get_json()
+
+
+def test_changesSinceVersion(makeApp):
+    app = makeApp(API_TOKEN="token")
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    client = app.test_client()
+    headers = {"Authorization": "Bearer token"}
+    wish = wishlist.addWish("Weltfrieden", 5)
+    snapshot = client.get("/api/changes", headers=headers).get_json()
+    assert [wish["title"] for wish in snapshot["wishes"]] == ["Weltfrieden"]
+
+    wishlist.markFulfilled(wish.id, "Tante")
+    delta = client.get(f"/api/changes?since={snapshot['version']}", headers=headers).get_json()
+    assert [change["kind"] for change in delta["changes"]] == ["fulfilled"]
+    assert delta["changes"][0]["wish"]["giver"] == "Tante"
+    assert "secret" not in delta["changes"][0]["wish"]
+    assert client.get(f"/api/changes?since={delta['version'] + 1}", headers=headers).status_code == 410
+
+
+@pytest.fixture
+def apiClient(app, client):
+    app.config["API_TOKEN"] = "token"
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer token"
+    return client
+
+
+def test_batchAppliesAllOperations(app, apiClient):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    first, second = wishlist.addWish("Weltfrieden", 5), wishlist.addWish("Shenanigans", 3)
+    third = wishlist.markFulfilled(wishlist.addWish("Buch", 1).id, "Onkel")
+    version = wishlist.version
+    response = apiClient.post(
+        "/api/wishes/batch?fields=id,giver",
+        json={
+            "operations": [
+                {"action": "fulfill", "id": first.id, "giver": "Tante"},
+                {"action": "delete", "id": second.id},
+                {"action": "reopen", "id": third.id},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "wishes": [
+            {"id": first.id, "giver": "Tante"},
+            {"id": second.id, "giver": ""},
+            {"id": third.id, "giver": ""},
+        ]
+    }
+    assert wishlist.getWishByID(second.id).status == wishes.STATUS_DELETED
+    changes = apiClient.get(f"/api/changes?since={version}").get_json()["changes"]
+    assert [change["kind"] for change in changes] == ["fulfilled", "deleted", "reopened"]
+    assert changes[2]["previous"] == {"giver": "Onkel"}
+
+
+def test_batchIsAllOrNothing(app, apiClient):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wish, endless = wishlist.addWish("Weltfrieden", 5), wishlist.addWish("Bücher", 3, endless=True)
+    response = apiClient.post(
+        "/api/wishes/batch",
+        json={
+            "operations": [
+                {"action": "fulfill", "id": wish.id, "giver": "Tante"},
+                {"action": "fulfill", "id": endless.id, "giver": "Tante"},
+            ]
+        },
+    )
+    assert response.status_code == 409
+    assert response.get_json()["index"] == 1
+    assert wishlist.getWishByID(wish.id).giver == ""
+    changes = apiClient.get("/api/changes?since=0").get_json()["changes"]
+    assert [change["kind"] for change in changes] == ["added", "added"]
+
+
+@pytest.mark.parametrize("action", ["reopen", "delete", "fulfill"])
+def test_batchRejectsDeletedWishes(app, apiClient, action):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wish = wishlist.addWish("Weltfrieden", 5)
+    wishlist.delWish(id=wish.id)
+    operation = {"action": action, "id": wish.id, "giver": "Tante"}
+    response = apiClient.post("/api/wishes/batch", json={"operations": [operation]})
+    assert response.status_code == 404
+    assert wishlist.getWishByID(wish.id).status == wishes.STATUS_DELETED
+
+
+def test_batchDoesNotOverwriteConcurrentFulfill(makeApp, tmp_path):
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}"}
+    worker, otherWorker = makeApp(**config), makeApp(**config)
+    wishlist = worker.extensions["wishlist"].wishlists[""]
+    wish = wishlist.addWish("Weltfrieden", 5)
+    with worker.app_context():
+        # The batch's session still holds the wish as it was before the other worker's claim
+        staleWish = wishlist.getWishByID(wish.id)
+        db.session.commit()
+        with otherWorker.app_context():
+            otherWishlist = otherWorker.extensions["wishlist"].wishlists[""]
+            claimed = otherWishlist.markFulfilled(wish.id, "Besucher")
+        with pytest.raises(BatchOperationError) as e:
+            wishlist.applyBatch([{"action": "fulfill", "id": wish.id, "giver": "Batch"}])
+        assert isinstance(e.value.error, WishFulfilledError)
+        assert staleWish.giver == "Besucher"
+    fulfilled = wishlist.getWishByID(wish.id)
+    assert (fulfilled.giver, fulfilled.secret) == ("Besucher", claimed.secret)
+
+
+def test_apiFieldSelection(app, client):
+    app.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5, desc="Für alle")
+    assert client.get("/api/wishes?fields=title,priority").get_json() == {
+        "wishes": [{"title": "Weltfrieden", "priority": 5}]
+    }
+    assert client.get("/api/wishes?fields=title,unbekannt").status_code == 400
+    # The giver is only for admins
+    assert client.get("/api/wishes?fields=giver").status_code == 400
+
+
+def test_fulfillFormAnswers(app, client):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wish = wishlist.addWish("Weltfrieden", 5)
+    endless = wishlist.addWish("Bücher", 2, endless=True)
+    deleted = wishlist.delWish(id=wishlist.addWish("Alt", 1).id)
+
+    response = client.post(f"/wishes/{wish.id}", data={"user_nickname": "Tante"})
+    secret = wishlist.getWishByID(wish.id).secret
+    assert response.status_code == 302
+    assert response.headers["Location"] == f"/wishes/{wish.id}/{secret}"
+
+    again = client.post(f"/wishes/{wish.id}", data={"user_nickname": "Onkel"})
+    assert again.status_code == 200
+    assert "schon als erledigt markiert" in again.get_data(as_text=True)
+
+    response = client.post(f"/wishes/{endless.id}", data={"user_nickname": "Tante"})
+    assert (response.status_code, response.headers["Location"]) == (302, "/")
+    assert client.post(f"/wishes/{deleted.id}", data={"user_nickname": "Tante"}).status_code == 404
+    assert client.post("/wishes/12345", data={"user_nickname": "Tante"}).status_code == 404
+    assert wishlist.getWishByID(wish.id).giver == "Tante"
+
+
+@pytest.mark.parametrize("giver", ["", "   "])
+def test_fulfillFormNeedsAGiver(app, client, giver):
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    wish = wishlist.addWish("Weltfrieden", 5)
+
+    assert client.post(f"/wishes/{wish.id}", data={"user_nickname": giver}).status_code == 400
+    assert wishlist.getWishByID(wish.id).status == wishes.STATUS_OPEN
+    with pytest.raises(ValueError):
+        wishlist.markFulfilled(wish.id, giver)
+    # Still up for grabs
+    assert client.post(f"/wishes/{wish.id}", data={"user_nickname": " Tante "}).status_code == 302
+    assert wishlist.getWishByID(wish.id).giver == "Tante"
+
+
+def test_eventsCarryOtherWorkersChanges(makeApp, tmp_path):
+    config = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}",
+        "CHANGE_POLL_SECONDS": 0.05,
+    }
+    worker, otherWorker = makeApp(**config), makeApp(**config)
+    events = (chunk.decode() for chunk in worker.test_client().get("/events").response)
+    assert next(events).startswith("retry:")
+
+    wish = otherWorker.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    event = next(events)
+    assert "event: change" in event
+    assert f'"wish": {wish.id}' in event and '"kind": "added"' in event
+
+
+SEARCH_TITLES = ["Weltfrieden", "Bücher für Tante Erna", "Andenken", "Bobs Brettspiel"]
+
+
+def searchTitles(client, query, path="/search"):
+    response = client.get(path, query_string={"q": query})
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    return [title for title in SEARCH_TITLES if title in page]
+
+
+@pytest.fixture
+def searchClient(makeApp):
+    app = makeApp(LISTS={"bob": {}})
+    lists = app.extensions["wishlist"].wishlists
+    lists[""].addWish("Weltfrieden", 5, desc="Für alle")
+    lists[""].addWish("Bücher für Tante Erna", 3)
+    lists[""].addWish("Andenken", 1)
+    lists["bob"].addWish("Bobs Brettspiel", 2)
+    return app.test_client()
+
+
+@pytest.mark.parametrize(
+    "query, titles",
+    [
+        # Every word matches as a prefix, not just the last one
+        ("Welt", ["Weltfrieden"]),
+        ("Büch Tan", ["Bücher für Tante Erna"]),
+        ("frieden", []),
+        # Diacritics are ignored both ways
+        ("Bucher", ["Bücher für Tante Erna"]),
+        ("fur", ["Weltfrieden", "Bücher für Tante Erna"]),
+    ],
+)
+def test_searchMatchesWordPrefixes(searchClient, query, titles):
+    assert sorted(searchTitles(searchClient, query)) == sorted(titles)
+
+
+@pytest.mark.parametrize("query", ['"Welt', "Welt*", "(Welt)", "Welt OR", "AND", "NEAR(Welt", "^Welt"])
+def test_searchQuotesFtsOperators(searchClient, query):
+    # Operators are searched for as words like any other
+    expected = {"AND": ["Andenken"], "Welt OR": [], "NEAR(Welt": []}.get(query, ["Weltfrieden"])
+    assert searchTitles(searchClient, query) == expected
+
+
+def test_searchStaysInItsList(searchClient):
+    assert searchTitles(searchClient, "Brett") == []
+    assert searchTitles(searchClient, "Brett", path="/bob/search") == ["Bobs Brettspiel"]
+    assert searchTitles(searchClient, "Welt", path="/bob/search") == []
@@ -0,0 +1,32 @@
+import re
+
+
+def assetPath(client, filename):
+    stem, extension = filename.rsplit(".", 1)
+    page = client.get("/").get_data(as_text=True)
+    return re.search(rf'"(/assets/{stem}\.[0-9a-f]{{12}}\.{extension})"', page).group(1)
+
+
+def test_assetsAreServedUnderFingerprint(client):
+    path = assetPath(client, "style.css")
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.mimetype == "text/css"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "Set-Cookie" not in response.headers
+    assert client.get("/assets/style.000000000000.css").status_code == 404
+
+
+def test_compressedAssetsHaveWeakETag(client):
+    path = assetPath(client, "style.css")
+    plain = client.get(path)
+    compressed = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert len(compressed.get_data()) < len(plain.get_data())
+    assert plain.headers["ETag"] == compressed.headers["ETag"]
+    assert plain.headers["ETag"].startswith("W/")
+
+    notModified = client.get(path, headers={"If-None-Match": compressed.headers["ETag"]})
+    assert notModified.status_code == 304
+    assert "Set-Cookie" not in notModified.headers
@@ -0,0 +1,69 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+BACKUP_NAMES = [
+    "wishes-20200101-120000.sqlite3.gz",
+    "wishes-20200101-120000-2.sqlite3.gz",
+    "wishes-20200101-120000-10.sqlite3.gz",
+    "wishes-20191231-235959.sqlite3.gz",
+]
+
+
+@pytest.fixture
+def backupApp(makeApp, tmp_path):
+    return makeApp(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'wishes.sqlite3'}",
+        BACKUP_DIR=str(tmp_path / "backups"),
+        BACKUP_COUNT=3,
+        BACKUP_INTERVAL_HOURS=0,
+        LISTS={"bob": {"ADMIN_SECRET": "bob"}},
+    )
+
+
+def addOldBackups(directory):
+    os.makedirs(directory)
+    for name in BACKUP_NAMES:
+        with open(directory / name, "wb") as f:
+            f.write(b"")
+
+
+def test_backupsAreListedAndRotatedNewestFirst(backupApp, tmp_path):
+    addOldBackups(tmp_path / "backups")
+    backups = backupApp.extensions["wishlist"].backups
+    assert [backup.name for backup in backups.list()] == [
+        "wishes-20200101-120000-10.sqlite3.gz",
+        "wishes-20200101-120000-2.sqlite3.gz",
+        "wishes-20200101-120000.sqlite3.gz",
+        "wishes-20191231-235959.sqlite3.gz",
+    ]
+
+    with backupApp.app_context():
+        backupApp.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+        report = backups.create()
+    assert report["deleted"] == ["wishes-20200101-120000.sqlite3.gz", "wishes-20191231-235959.sqlite3.gz"]
+    assert [backup.name for backup in backups.list()] == [
+        report["name"],
+        "wishes-20200101-120000-10.sqlite3.gz",
+        "wishes-20200101-120000-2.sqlite3.gz",
+    ]
+    restored = tmp_path / "restored.sqlite3"
+    with gzip.open(tmp_path / "backups" / report["name"]) as source, open(restored, "wb") as target:
+        target.write(source.read())
+    with sqlite3.connect(restored) as connection:
+        assert connection.execute("SELECT title FROM wishes").fetchall() == [("Weltfrieden",)]
+    connection.close()
+
+
+def test_onlyTheMainListsAdminSeesBackups(backupApp, tmp_path):
+    addOldBackups(tmp_path / "backups")
+    client = backupApp.test_client()
+    client.get("/login/test")
+    assert BACKUP_NAMES[0] in client.get("/admin").get_data(as_text=True)
+
+    client.get("/bob/login/bob")
+    assert BACKUP_NAMES[0] not in client.get("/bob/admin").get_data(as_text=True)
+    client.post("/bob/admin", data={"action": "backup"})
+    assert sorted(os.listdir(tmp_path / "backups")) == sorted(BACKUP_NAMES)
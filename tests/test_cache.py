@@ -0,0 +1,17 @@
+# Temporarily add parent folder to python path so we can import cache
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import RenderCache
+
+def test_renderCacheEvictsLeastRecentlyUsed():
+    cache = RenderCache(maxSize=2)
+    cache.getOrRender("a", lambda: "A")
+    cache.getOrRender("b", lambda: "B")
+    assert cache.getOrRender("a", lambda: "stale") == "A"
+    cache.getOrRender("c", lambda: "C")
+
+    assert cache.getOrRender("b", lambda: "B2") == "B2"
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert len(cache) == 2
@@ -0,0 +1,79 @@
+import sqlite3
+
+from database import MIGRATIONS
+
+# The wishes table as created before there were migrations
+BASELINE_SCHEMA = """
+CREATE TABLE wishes (
+    id INTEGER NOT NULL,
+    title VARCHAR NOT NULL,
+    priority INTEGER NOT NULL,
+    "desc" VARCHAR NOT NULL,
+    link VARCHAR NOT NULL,
+    endless BOOLEAN NOT NULL,
+    giver VARCHAR NOT NULL,
+    secret VARCHAR NOT NULL,
+    deleted DATETIME,
+    PRIMARY KEY (id)
+)
+"""
+
+
+def schemaNames(connection, type):
+    rows = connection.execute("SELECT name FROM sqlite_master WHERE type = ?", (type,))
+    return {name for name, in rows}
+
+
+def test_migrateBaselineDatabase(makeApp, tmp_path):
+    path = tmp_path / "wishes.sqlite3"
+    with sqlite3.connect(path) as connection:
+        connection.execute(BASELINE_SCHEMA)
+        connection.executemany(
+            """
+            INSERT INTO wishes (title, priority, "desc", link, endless, giver, secret, deleted)
+            VALUES (?, ?, '', '', 0, ?, ?, ?)
+            """,
+            [
+                ("Weltfrieden", 5, "", "", None),
+                ("Shenanigans", 3, "", "", None),
+                ("Buch", 2, "Tante", "abc", None),
+                ("Alt", 1, "", "", "2020-01-01 00:00:00.000000"),
+            ],
+        )
+    connection.close()
+
+    app = makeApp(SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}")
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert connection.execute("SELECT title, secret, status FROM wishes ORDER BY id").fetchall() == [
+        ("Weltfrieden", None, 0),
+        ("Shenanigans", None, 0),
+        ("Buch", "abc", 1),
+        ("Alt", None, 2),
+    ]
+    assert {"ix_wishes_secret", "ix_wishes_list_status_priority"} <= schemaNames(connection, "index")
+    assert "ix_wishes_list_deleted_giver_priority" not in schemaNames(connection, "index")
+    assert "AUTOINCREMENT" in connection.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'wishes'"
+    ).fetchone()[0]
+    assert connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'wishes'").fetchone() == (4,)
+    assert {"wishes_fts_insert", "wishes_fts_delete", "wishes_fts_update"} <= schemaNames(
+        connection, "trigger"
+    )
+    connection.close()
+    # Open wishes no longer share a secret, so the unique index allows more of them
+    wishlist = app.extensions["wishlist"].wishlists[""]
+    assert wishlist.addWish("Noch ein Wunsch", 1).id == 5
+    assert [wish.title for wish in wishlist.search("Welt")] == ["Weltfrieden"]
+
+
+def test_migrateIsIdempotent(makeApp, tmp_path):
+    uri = f"sqlite:///{tmp_path / 'wishes.sqlite3'}"
+    makeApp(SQLALCHEMY_DATABASE_URI=uri).extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    makeApp(SQLALCHEMY_DATABASE_URI=uri)
+
+    connection = sqlite3.connect(tmp_path / "wishes.sqlite3")
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert connection.execute("SELECT title FROM wishes").fetchall() == [("Weltfrieden",)]
+    connection.close()
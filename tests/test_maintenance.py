@@ -0,0 +1,56 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+import maintenance
+from database import db
+from wishes import WishChange
+
+
+def test_vacuumFreesAStepOfPagesAtATime(makeApp, tmp_path, monkeypatch):
+    path = tmp_path / "wishes.sqlite3"
+    app = makeApp(SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}", DELETED_RETENTION_DAYS=0)
+    with app.app_context():
+        wishlist = app.extensions["wishlist"].wishlists[""]
+        for i in range(50):
+            wishlist.addWish(f"Wunsch {i}", 1, desc="x" * 20000)
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM wishes")
+    connection.close()
+
+    def freePages():
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            connection.close()
+
+    freePagesBefore = freePages()
+    assert freePagesBefore > 100
+    steps = []
+    monkeypatch.setattr(maintenance, "VACUUM_STEP_PAGES", 40)
+    monkeypatch.setattr(maintenance, "sleep", lambda seconds: steps.append(freePages()))
+    with app.app_context():
+        report = app.extensions["wishlist"].maintenance.run()
+
+    assert steps == [max(freePagesBefore - 40 * step, 0) for step in range(1, len(steps) + 1)]
+    assert steps[-1] == 0 and len(steps) == -(-freePagesBefore // 40)
+    assert report["freePages"] == freePagesBefore
+
+
+def test_maintenancePrunesChangeJournalWithoutPolling(app):
+    # The test config turns polling off, pruning doesn't depend on it
+    state = app.extensions["wishlist"]
+    wishlist = state.wishlists[""]
+    for title in ["Eins", "Zwei", "Drei"]:
+        wishlist.addWish(title, 3)
+    db.session.execute(update(WishChange).values(created=datetime.now() - timedelta(days=365)))
+    db.session.commit()
+    version = wishlist.version
+
+    report = state.maintenance.run()
+    # The newest change is the list's version and stays, however old it is
+    assert report["prunedChanges"] == 2
+    assert db.session.scalars(select(WishChange.id)).all() == [version]
+    assert wishlist.version == version
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from snapshots import VERSION_FILE, VIEW_DYNAMIC, VIEW_SNAPSHOT, viewCookieName
+
+
+def snapshotConfig(tmp_path):
+    # A database file, the publisher thread can't share the in-memory one
+    return {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'wishes.sqlite3'}",
+        "SNAPSHOT_DIR": str(tmp_path / "snapshots"),
+    }
+
+
+@pytest.fixture
+def snapshotApp(makeApp, tmp_path):
+    return makeApp(**snapshotConfig(tmp_path))
+
+
+def readSnapshot(tmp_path, filename, listSlug=""):
+    with open(tmp_path / "snapshots" / listSlug / filename, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_publishWritesBothViews(snapshotApp, tmp_path):
+    state = snapshotApp.extensions["wishlist"]
+    with snapshotApp.app_context():
+        wishlist = state.wishlists[""]
+        wishlist.addWish("Weltfrieden", 5)
+        wishlist.markFulfilled(wishlist.addWish("Buch", 3).id, "Tante")
+        version = wishlist.version
+    state.snapshots.publish("")
+
+    page = readSnapshot(tmp_path, "index.html")
+    assert "Weltfrieden" in page and page.count("<del>") == 1
+    noSpoilerPage = readSnapshot(tmp_path, "no-spoiler.html")
+    assert "Buch" in noSpoilerPage and "<del>" not in noSpoilerPage
+    assert readSnapshot(tmp_path, VERSION_FILE) == str(version)
+    # Written atomically: no temporary files are left, and the web server can read them
+    files = os.listdir(tmp_path / "snapshots")
+    assert not [name for name in files if name.startswith(".tmp-")]
+    assert os.stat(tmp_path / "snapshots" / "index.html").st_mode & 0o777 == 0o644
+
+
+def test_newerSnapshotsAreNotReplaced(snapshotApp, tmp_path):
+    state = snapshotApp.extensions["wishlist"]
+    state.snapshots.publish("")
+    with open(tmp_path / "snapshots" / VERSION_FILE, "w") as f:
+        f.write("1000000")
+    with snapshotApp.app_context():
+        state.wishlists[""].addWish("Weltfrieden", 5)
+    state.snapshots.publish("")
+
+    assert "Weltfrieden" not in readSnapshot(tmp_path, "index.html")
+    assert readSnapshot(tmp_path, VERSION_FILE) == "1000000"
+
+
+def test_viewCookieTellsWhichSnapshotFits(snapshotApp):
+    with snapshotApp.app_context():
+        wish = snapshotApp.extensions["wishlist"].wishlists[""].addWish("Weltfrieden", 5)
+    name = viewCookieName("")
+
+    visitor = snapshotApp.test_client()
+    visitor.get("/").get_data()
+    assert visitor.get_cookie(name) is None
+
+    visitor.get("/no-spoiler").get_data()
+    assert visitor.get_cookie(name).value == VIEW_SNAPSHOT
+    visitor.get("/yes-spoiler")
+    assert visitor.get_cookie(name) is None
+
+    gifter = snapshotApp.test_client()
+    location = gifter.post(f"/wishes/{wish.id}", data={"user_nickname": "Tante"}).headers["Location"]
+    gifter.get(location).get_data()
+    assert gifter.get_cookie(name).value == VIEW_DYNAMIC
+
+    admin = snapshotApp.test_client()
+    admin.get("/login/test")
+    assert admin.get_cookie(name).value == VIEW_DYNAMIC
+
+
+def test_viewCookieIsPerList(makeApp, tmp_path):
+    app = makeApp(**snapshotConfig(tmp_path), LISTS={"bob-list": {}})
+    client = app.test_client()
+    client.get("/bob-list/no-spoiler").get_data()
+
+    cookie = client.get_cookie("wishlist_view_bob_list", path="/bob-list")
+    assert cookie.value == VIEW_SNAPSHOT
+    assert client.get_cookie(viewCookieName("")) is None
+    assert os.path.exists(tmp_path / "snapshots" / "bob-list" / "index.html")
@@ -0,0 +1,77 @@
+import pytest
+
+LISTS = {"bob": {"ADMIN_SECRET": "bob"}, "carol": {"ADMIN_SECRET": "carol", "HOST": "carol.example.com"}}
+
+
+@pytest.fixture
+def listsApp(makeApp):
+    return makeApp(LISTS=LISTS)
+
+
+def addWish(app, listSlug, title):
+    with app.app_context():
+        app.extensions["wishlist"].wishlists[listSlug].addWish(title, 3)
+
+
+def test_listsAreFoundByPathAndHost(listsApp):
+    addWish(listsApp, "", "Hauptwunsch")
+    addWish(listsApp, "bob", "Bobs Wunsch")
+    addWish(listsApp, "carol", "Carols Wunsch")
+    client = listsApp.test_client()
+
+    assert "Hauptwunsch" in client.get("/").get_data(as_text=True)
+    bobsPage = client.get("/bob").get_data(as_text=True)
+    assert "Bobs Wunsch" in bobsPage and "Hauptwunsch" not in bobsPage
+    assert 'href="/bob/' in bobsPage
+    assert "Carols Wunsch" in client.get("/carol/").get_data(as_text=True)
+    carolsHostPage = client.get("/", headers={"Host": "carol.example.com"}).get_data(as_text=True)
+    assert "Carols Wunsch" in carolsHostPage and "Hauptwunsch" not in carolsHostPage
+
+
+def test_loginIsPerList(listsApp):
+    client = listsApp.test_client()
+    response = client.get("/bob/login/bob")
+    cookie = response.headers["Set-Cookie"]
+    assert cookie.startswith("session-bob=") and "Path=/bob" in cookie
+
+    assert client.get("/bob/admin").status_code == 200
+    assert client.get("/admin").status_code == 401
+    # Another list's admin secret doesn't log in
+    assert client.get("/bob/login/test").status_code == 404
+
+
+@pytest.mark.parametrize("cookieName, adminPath", [("session-carol", "/carol/admin"), ("session", "/admin")])
+def test_sessionCookieIsBoundToItsList(listsApp, cookieName, adminPath):
+    bob = listsApp.test_client()
+    bob.get("/bob/login/bob")
+    assert bob.get("/bob/admin").status_code == 200
+
+    replay = listsApp.test_client()
+    replay.set_cookie(cookieName, bob.get_cookie("session-bob", path="/bob").value)
+    assert replay.get(adminPath).status_code == 401
+
+
+def test_wishesCantBeReachedFromOtherLists(listsApp):
+    with listsApp.app_context():
+        wish = listsApp.extensions["wishlist"].wishlists["bob"].addWish("Bobs Wunsch", 3)
+    client = listsApp.test_client()
+
+    assert client.get(f"/bob/wishes/{wish.id}").status_code == 200
+    assert client.get(f"/wishes/{wish.id}").status_code == 404
+    assert client.post(f"/wishes/{wish.id}", data={"user_nickname": "Eve"}).status_code == 404
+
+
+def test_appWideEndpointsOnlyOnMainList(listsApp):
+    client = listsApp.test_client()
+    client.get("/bob/login/bob")
+    assert client.get("/bob/metrics").status_code == 404
+    assert client.get("/bob/api/jobs").status_code == 404
+
+    client.get("/login/test")
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/api/jobs").status_code == 200
+
+
+def test_listNameMustNotHideRoute(makeApp):
+    with pytest.raises(ValueError):
+        makeApp(LISTS={"admin": {}})
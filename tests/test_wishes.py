@@ -1,4 +1,7 @@
+from datetime import datetime, timedelta
+
 import pytest
+from sqlalchemy import event
 
 # Temporarily add parent folder to python path so we can import wishes
 import os
@@ -7,13 +10,127 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import app
 import wishes
+from database import db
+
+@pytest.fixture(autouse=True)
+def exampleWishes(app):
+    wishlist = wishes.Wishlist()
+    wishlist.addWish("Shenanigans", 3, "Für mehr Blödsinn!", link = "https://youtu.be/dQw4w9WgXcQ?si=B8g9pOJgWpztlIZw")
+    wishlist.addWish("Weltfrieden", 5)
+    wishlist.addWish("Wäre ganz nett", 1, desc="Das hier wäre auch ganz nett. Ist aber nicht besonders wichtig.")
 
 def test_getPriorityOrderedWishes():
     wishlist = wishes.Wishlist()
-    # wishlist.addWish("Shenanigans", 3, "Für mehr Blödsinn!", link = "https://youtu.be/dQw4w9WgXcQ?si=B8g9pOJgWpztlIZw")
-    # wishlist.addWish("Weltfrieden", 5)
-    # wishlist.addWish("Wäre ganz nett", 1, desc="Das hier wäre auch ganz nett. Ist aber nicht besonders wichtig.")
 
-    orderedWishes = wishlist.getPriorityOrderedWishes()
+    orderedWishes = list(wishlist.iterPriorityOrderedWishes())
     assert [wish.title for wish in orderedWishes] == ["Weltfrieden", "Shenanigans", "Wäre ganz nett"]
 
+
+
+def getWishByTitle(wishlist, title):
+    return next(wish for wish in wishlist.iterPriorityOrderedWishesNoSpoiler() if wish.title == title)
+
+
+def test_reopenWishChecksSecret():
+    wishlist = wishes.Wishlist()
+    wish = wishlist.markFulfilled(getWishByTitle(wishlist, "Weltfrieden").id, "Tante")
+
+    with pytest.raises(wishes.SecretMismatchError):
+        wishlist.reopenWish(wish.id, secret="falsch")
+    assert wishlist.getWishByID(wish.id).giver == "Tante"
+
+    reopened = wishlist.reopenWish(wish.id, secret=wish.secret)
+    assert (reopened.giver, reopened.secret) == ("", None)
+
+
+def test_deleteAndRestoreBySecret():
+    wishlist = wishes.Wishlist()
+    wish = wishlist.markFulfilled(getWishByTitle(wishlist, "Weltfrieden").id, "Tante")
+
+    assert wishlist.delWish(secret=wish.secret).deleted is not None
+    assert wishlist.undelWish(secret=wish.secret).deleted is None
+    with pytest.raises(wishes.WishNotFoundError):
+        wishlist.delWish(secret="falsch")
+
+
+def test_wishIsLoadedOncePerSession():
+    wishlist = wishes.Wishlist()
+    wishID = getWishByTitle(wishlist, "Weltfrieden").id
+    db.session.expunge_all()
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        first = wishlist.getWishByID(wishID)
+        second = wishlist.getWishByID(wishID)
+        deleted = wishlist.delWish(id=wishID)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+    assert first is second is deleted
+    assert len([statement for statement in statements if statement.startswith("SELECT")]) == 1
+
+
+def test_markFulfilledClaimsOnce():
+    wishlist = wishes.Wishlist()
+    wishID = getWishByTitle(wishlist, "Weltfrieden").id
+    wish = wishlist.markFulfilled(wishID, "Tante")
+    assert (wish.giver, wish.status) == ("Tante", wishes.STATUS_FULFILLED)
+    assert wish.secret
+
+    with pytest.raises(wishes.WishFulfilledError):
+        wishlist.markFulfilled(wishID, "Onkel")
+    assert wishlist.getWishByID(wishID).giver == "Tante"
+
+
+def test_markFulfilledRejectsEndlessDeletedAndUnknownWishes():
+    wishlist = wishes.Wishlist()
+    endless = wishlist.addWish("Bücher", 2, endless=True)
+    deleted = wishlist.delWish(id=getWishByTitle(wishlist, "Weltfrieden").id)
+
+    with pytest.raises(wishes.WishEndlessError):
+        wishlist.markFulfilled(endless.id, "Tante")
+    with pytest.raises(wishes.WishNotFoundError):
+        wishlist.markFulfilled(deleted.id, "Tante")
+    with pytest.raises(wishes.WishNotFoundError):
+        wishlist.markFulfilled(12345, "Tante")
+    # Wishes of other lists can't be claimed either
+    otherList = wishes.Wishlist(listSlug="andere")
+    with pytest.raises(wishes.WishNotFoundError):
+        otherList.markFulfilled(getWishByTitle(wishlist, "Shenanigans").id, "Tante")
+
+
+def test_statusFollowsGiverAndDeleted():
+    wishlist = wishes.Wishlist()
+    wishID = getWishByTitle(wishlist, "Weltfrieden").id
+    unchanged = {"title": None, "priority": None, "desc": None, "link": None, "endless": None}
+
+    def status():
+        return wishlist.getWishByID(wishID).status
+
+    wish = wishlist.markFulfilled(wishID, "Tante")
+    assert status() == wishes.STATUS_FULFILLED
+    wishlist.delWish(id=wishID)
+    assert status() == wishes.STATUS_DELETED
+    wishlist.undelWish(id=wishID)
+    assert status() == wishes.STATUS_FULFILLED
+    wishlist.reopenWish(wishID, secret=wish.secret)
+    assert status() == wishes.STATUS_OPEN
+    wishlist.modifyWish(wishID, giver="Onkel", **unchanged)
+    assert status() == wishes.STATUS_FULFILLED
+    wishlist.modifyWish(wishID, giver="", **unchanged)
+    assert status() == wishes.STATUS_OPEN
+    assert [wish.title for wish in wishlist.iterPriorityOrderedWishes()][0] == "Weltfrieden"
+
+
+def test_archivedWishIDsAreNotReused():
+    wishlist = wishes.Wishlist()
+    future = datetime.now() + timedelta(days=1)
+    newestID = getWishByTitle(wishlist, "Wäre ganz nett").id
+    wishlist.delWish(id=newestID)
+    assert wishlist.archiveDeleted(deletedBefore=future) == 1
+
+    wish = wishlist.addWish("Nachzügler", 1)
+    assert wish.id > newestID
+    wishlist.delWish(id=wish.id)
+    assert wishlist.archiveDeleted(deletedBefore=future) == 1
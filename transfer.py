@@ -0,0 +1,95 @@
+import csv
+import json
+from datetime import datetime
+from io import StringIO
+from typing import IO, Iterable, Iterator
+
+EXPORT_FIELDS = [
+    "id",
+    "title",
+    "priority",
+    "desc",
+    "link",
+    "endless",
+    "giver",
+    "secret",
+    "deleted",
+]
+
+FORMATS = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _toJsonable(record: dict):
+    record = dict(record)
+    if record["deleted"] is not None:
+        record["deleted"] = record["deleted"].isoformat()
+    return record
+
+
+def _toBool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "ja", "x")
+    return bool(value)
+
+
+def _toWishFields(record: dict, entry: int):
+    """
+    Turn an imported record into keyword arguments for Wish.
+    IDs are dropped, imported wishes always get new ones.
+    """
+    try:
+        fields = {"title": record.get("title") or "", "priority": int(record["priority"])}
+        for key in ("desc", "link", "giver", "secret"):
+            if record.get(key):
+                fields[key] = str(record[key])
+        if "endless" in record:
+            fields["endless"] = _toBool(record["endless"])
+        if record.get("deleted"):
+            fields["deleted"] = datetime.fromisoformat(record["deleted"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Entry {entry}: invalid or missing field {e}") from e
+    return fields
+
+
+def readJsonl(stream: IO[str]) -> Iterator[dict]:
+    entry = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        entry += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Entry {entry}: {e}") from e
+        if not isinstance(record, dict):
+            raise ValueError(f"Entry {entry}: expected an object")
+        yield _toWishFields(record, entry)
+
+
+def readCsv(stream: IO[str]) -> Iterator[dict]:
+    for entry, record in enumerate(csv.DictReader(stream), start=1):
+        yield _toWishFields(record, entry)
+
+
+def writeJsonl(records: Iterable[dict]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(_toJsonable(record), ensure_ascii=False) + "\n"
+
+
+def writeCsv(records: Iterable[dict]) -> Iterator[str]:
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(_toJsonable(record))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+READERS = {"jsonl": readJsonl, "csv": readCsv}
+WRITERS = {"jsonl": writeJsonl, "csv": writeCsv}
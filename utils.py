@@ -1,15 +1,33 @@
 from functools import wraps
+from hashlib import sha256
+from hmac import compare_digest
 from typing import Callable
 from flask import (
     Flask,
+    before_render_template,
+    current_app,
+    jsonify,
+    make_response,
     render_template,
+    request,
     session,
+    stream_with_context,
+    template_rendered,
 )
 
 SESSION_NO_SPOILER = "noSpoiler"
 SESSION_FULFILLED_WISHES = "fulfilledWishes"
+# Wishlist version at which the fulfilled wishes in the session were last checked
+SESSION_FULFILLED_WISHES_VERSION = "fulfilledWishesVersion"
 SESSION_IS_LOGGED_IN = "isLoggedIn"
 
+# Number of template output pieces joined into one chunk when streaming
+STREAM_BUFFER_SIZE = 500
+# Maximum number of journal entries returned by /api/changes at once
+CHANGES_PAGE_SIZE = 1000
+# Maximum number of wish IDs or batch operations in one API request
+API_BATCH_SIZE = 1000
+
 
 def setDefaultConfigValues(app):
     # Default config value dict
@@ -17,6 +35,24 @@ def setDefaultConfigValues(app):
         "OWNER_NAME": "Jemand",
         "SQLALCHEMY_DATABASE_URI": "sqlite:///wishes.sqlite3",
         "THEME_HUE": 260,
+        "RENDER_CACHE_SIZE": 256,
+        "FRAGMENT_CACHE_SIZE": 10000,
+        "DELETED_WISHES_PAGE_SIZE": 50,
+        "MAX_FULFILLED_WISHES": 100,
+        "CHANGE_POLL_SECONDS": 1,
+        "CHANGE_RETENTION_HOURS": 24 * 30,
+        "MAINTENANCE_INTERVAL_HOURS": 24,
+        "DELETED_RETENTION_DAYS": 365,
+        "BACKUP_DIR": "",
+        "BACKUP_COUNT": 7,
+        "BACKUP_INTERVAL_HOURS": 24,
+        "SLOW_REQUEST_SECONDS": 1,
+        "SQLITE_BUSY_TIMEOUT": 5000,
+        "SQLITE_AUTO_VACUUM": "INCREMENTAL",
+        "SQLITE_JOURNAL_MODE": "WAL",
+        "SQLITE_SYNCHRONOUS": "NORMAL",
+        "SQLITE_CACHE_SIZE": -16000,
+        "SQLITE_MMAP_SIZE": 64 * 1024 * 1024,
     }
     # for any key not already set, set the default value
     for key, value in defaultConfig.items():
@@ -24,13 +60,42 @@ def setDefaultConfigValues(app):
             app.config[key] = value
 
 
-def admin(app: Flask):
+def isAdmin(tokenConfigKey: str | None = None):
+    """
+    Args:
+        tokenConfigKey (str, optional): Config key of a token that also grants access
+            when sent as "Authorization: Bearer <token>". Defaults to None.
+
+    Returns:
+        whether the current request is made by a logged in admin or with the token
+    """
+    token = current_app.config.get(tokenConfigKey) if tokenConfigKey else None
+    if token and compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    return bool(session.get(SESSION_IS_LOGGED_IN, False))
+
+
+def admin(tokenConfigKey: str | None = None, jsonErrors: bool = False):
+    """
+    Only allow logged in admins to use a view.
+
+    Args:
+        tokenConfigKey (str, optional): Config key of a token that also grants access
+            when sent as "Authorization: Bearer <token>". Defaults to None.
+        jsonErrors (bool, optional): answer others with a JSON error instead of
+            the error page, for API clients. Defaults to False.
+    """
+
     def adminDecorator(f: Callable):
         @wraps(f)
         def adminWrapper(*args, **kwds):
-            if not session.get(SESSION_IS_LOGGED_IN, False):
+            if not isAdmin(tokenConfigKey):
+                if jsonErrors:
+                    return jsonError(
+                        401, "Nicht eingeloggt, ein API-Token oder Admin-Login ist nötig."
+                    )
                 return error(
-                    app,
+                    current_app,
                     code=401,
                     title="Nicht eingeloggt!",
                     message="Bitte logge dich als Admin ein, um diese Seite zu benutzen.",
@@ -52,3 +117,64 @@ def error(app: Flask, code: int, title: str, message: str):
         ),
         code,
     )
+
+
+def jsonError(code: int, message: str):
+    return jsonify(error=message), code
+
+
+def conditional(etagParts: tuple, render: Callable):
+    """
+    Answer a request with 304 Not Modified if the client already has the current
+    version of the page, otherwise render it.
+
+    Args:
+        etagParts (tuple): Everything the page depends on, with versions read from
+            the database. Its repr must be the same in every worker process, so
+            use sorted lists instead of sets. The app's fingerprint of templates,
+            assets and settings is added.
+        render (Callable): Called without arguments to render the page if needed.
+
+    Returns:
+        the response, with an ETag for successful responses
+    """
+    fingerprint = current_app.extensions["wishlist"].fingerprint
+    etag = sha256(repr((fingerprint, etagParts)).encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+    # Error pages are not worth revalidating
+    if response.status_code in (200, 304):
+        response.set_etag(etag)
+    # Pages depend on the session, so only the browser may keep them, and it has to revalidate
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def streamTemplate(templateName: str, **context):
+    """
+    Render a template as a stream, like flask.stream_template. Jinja's many
+    small output pieces are joined into larger chunks first, so streaming
+    doesn't cost a generator round trip per piece and each write to the
+    client carries a useful amount of data.
+
+    Args:
+        templateName (str): name of the template
+        **context: the template variables
+
+    Returns:
+        an iterator over the chunks of the rendered template
+    """
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(templateName)
+    app.update_template_context(context)
+    before_render_template.send(app, template=template, context=context)
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+
+    def generate():
+        yield from stream
+        template_rendered.send(app, template=template, context=context)
+
+    return stream_with_context(generate())
@@ -1,15 +1,85 @@
-from sqlalchemy import Integer, String, select
+from sqlalchemy import JSON, Index, Integer, String, case, func, literal_column, select, tuple_, update
+from sqlalchemy import insert
+from sqlalchemy import column, table
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Mapped, mapped_column
+from contextlib import contextmanager
+from flask import Flask, has_app_context
+from flask.signals import Namespace
 from urllib.parse import urlparse
 from uuid import uuid4
 from datetime import datetime
+from functools import lru_cache
+from heapq import merge
+import re
+from typing import Iterable, NamedTuple
 
-from app import db, app
+from database import db
+
+
+# Sent after a change to a wishlist was committed
+wishlistChanged = Namespace().signal("wishlist-changed")
+# Kinds of changes, as recorded in the wish_changes table and sent with
+# wishlistChanged. "batch" is only sent, the operations of a batch are
+# recorded one by one with their own kinds.
+CHANGE_KINDS = (
+    "added",
+    "imported",
+    "modified",
+    "deleted",
+    "restored",
+    "fulfilled",
+    "reopened",
+    "archived",
+    "batch",
+)
+
+# Actions Wishlist.applyBatch can do, with the kind of change each one records
+BATCH_ACTIONS = {"fulfill": "fulfilled", "reopen": "reopened", "delete": "deleted"}
+
+# Values of Wish.status, which list queries filter and sort by. Endless
+# wishes can't be fulfilled, so they stay open.
+STATUS_OPEN = 0
+STATUS_FULFILLED = 1
+STATUS_DELETED = 2
+
+# Words of a search, anything else is ignored so it can't break the FTS5 query syntax
+SEARCH_WORD_PATTERN = re.compile(r"\w+")
+# How much more a match in the title counts than one in the description
+SEARCH_TITLE_WEIGHT = 10.0
+# The FTS5 search index created by database._searchIndex, not part of the ORM metadata
+SEARCH_INDEX = table("wishes_fts", column("rowid"))
 
 
 class Wishlist:
-    def __init__(self):
+    def __init__(self, listSlug: str = "", app: Flask | None = None):
+        """
+        Args:
+            listSlug (str, optional): the list whose wishes this manages. Defaults to '', the default list.
+            app (Flask, optional): app to use when called outside of an app context.
+                Defaults to None, only work within an app context.
+        """
         self.db = db
+        self.app = app
+        self.listSlug = listSlug
+        # (version, AdminSnapshot) of the last admin snapshot
+        self.__adminSnapshot = None
+
+    @property
+    def version(self):
+        """
+        The ID of the list's latest change in the wish_changes table. Every
+        change is recorded there in the same transaction, so the version is
+        the same in every worker process and anything derived from the list
+        can be cached against it.
+        """
+        with self.__session():
+            return (
+                db.session.scalar(
+                    select(func.max(WishChange.id)).where(WishChange.listSlug == self.listSlug)
+                )
+                or 0
+            )
 
     def addWish(
         self,
@@ -22,20 +92,131 @@ class Wishlist:
         secret: str = "",
         deleted: datetime | None = None,
     ):
-        with app.app_context():
-            db.session.add(
-                Wish(
-                    title,
-                    priority,
-                    desc=desc,
-                    link=link,
-                    endless=endless,
-                    giver=giver,
-                    secret=secret,
-                    deleted=deleted,
+        wish = Wish(
+            title,
+            priority,
+            desc=desc,
+            link=link,
+            endless=endless,
+            giver=giver,
+            secret=secret,
+            deleted=deleted,
+            listSlug=self.listSlug,
+        )
+        with self.__session():
+            db.session.add(wish)
+            db.session.flush()
+            self.__commitChange("added", wish)
+        return wish
+
+    def bulkAdd(self, wishes: Iterable[dict], batchSize: int = 500):
+        """
+        Add many wishes in a single transaction. Nothing is added if any of them is invalid.
+
+        Args:
+            wishes (Iterable[dict]): keyword arguments for Wish, consumed lazily
+            batchSize (int, optional): how many wishes to insert per statement. Defaults to 500.
+
+        Raises:
+            ValueError: Is raised if a wish is invalid or its secret is already taken.
+
+        Returns:
+            number of added wishes
+        """
+        count = 0
+        with self.__session():
+            try:
+                batch = []
+                for count, fields in enumerate(wishes, start=1):
+                    try:
+                        batch.append(Wish(**fields, listSlug=self.listSlug))
+                    except (TypeError, ValueError) as e:
+                        raise ValueError(f"Entry {count}: {e}") from e
+                    if len(batch) >= batchSize:
+                        self.__flushBatch(batch)
+                        batch = []
+                self.__flushBatch(batch)
+                self.__commitChange("imported")
+            except IntegrityError as e:
+                db.session.rollback()
+                raise ValueError("Secrets must be unique.") from e
+            except BaseException:
+                # The session may be shared with the rest of the request, which
+                # must not see the wishes flushed so far
+                db.session.rollback()
+                raise
+        return count
+
+    def exportAll(self, batchSize: int = 500):
+        """
+        Stream all wishes, including deleted ones, ordered by ID.
+
+        Args:
+            batchSize (int, optional): how many wishes to fetch from the db at once. Defaults to 500.
+
+        Yields:
+            dict with the fields of one wish
+        """
+        with self.__session():
+            for wish in db.session.scalars(
+                select(Wish)
+                .where(self.__inList())
+                .order_by(Wish.id)
+                .execution_options(yield_per=batchSize)
+            ):
+                yield wish.toDict()
+
+    def getSnapshot(self):
+        """
+        All wishes, including deleted ones, and the journal version they are at.
+        The version is read first, so syncing from it may apply a change made
+        while the wishes were read twice, but never misses one.
+
+        Returns:
+            the version and the journal fields of every wish, ordered by ID
+        """
+        with self.__session():
+            version = self.__latestChangeID()
+            wishes = [
+                _journalFields(wish)
+                for wish in db.session.scalars(
+                    select(Wish).where(self.__inList()).order_by(Wish.id)
                 )
-            )
-            db.session.commit()
+            ]
+        return version, wishes
+
+    def getChanges(self, since: int, limit: int = 1000):
+        """
+        The journal of the list after a version, oldest change first.
+
+        Args:
+            since (int): the version the caller has seen, 0 for the whole journal
+            limit (int, optional): maximum number of changes. Defaults to 1000.
+
+        Raises:
+            ChangesExpiredError: Is raised if changes after since were pruned, or
+                since is newer than the journal.
+
+        Returns:
+            the changes, the version to pass as since next time, and whether
+            there are more changes after it
+        """
+        with self.__session():
+            latest = self.__latestChangeID()
+            oldest = db.session.scalar(select(func.min(WishChange.id))) or 1
+            if since < oldest - 1 or since > latest:
+                raise ChangesExpiredError()
+            rows = db.session.scalars(
+                select(WishChange)
+                .where((WishChange.listSlug == self.listSlug) & (WishChange.id > since))
+                .order_by(WishChange.id)
+                .limit(limit + 1)
+            ).all()
+        hasMore = len(rows) > limit
+        changes = [row.toDict() for row in rows[:limit]]
+        # Without more changes of this list, the caller can skip the other lists' changes
+        version = changes[-1]["version"] if hasMore else latest
+        return changes, version, hasMore
 
     def modifyWish(
         self,
@@ -48,105 +229,343 @@ class Wishlist:
         endless: bool | None,
         giver: str | None,
     ):
-        with app.app_context():
+        with self.__session():
             wish = self.__dbCallGetWishById(id)
-            if title is not None:
-                wish.title = title
-            if priority is not None:
-                wish.priority = priority
-            if desc is not None:
-                wish.desc = desc
-            if link is not None:
-                wish.link = link
-            if endless is not None:
-                wish.endless = endless
-            if giver is not None:
-                wish.giver = giver
-            db.session.commit()
+            changes = {
+                "title": title,
+                "priority": priority,
+                "desc": desc,
+                "link": link,
+                "endless": endless,
+                "giver": giver,
+            }
+            previous = {}
+            for field, value in changes.items():
+                if value is not None and value != getattr(wish, field):
+                    previous[field] = getattr(wish, field)
+                    setattr(wish, field, value)
+            wish.updateStatus()
+            self.__commitChange("modified", wish, previous)
+        return wish
 
     def delWish(self, id="", secret=""):
-        with app.app_context():
+        with self.__session():
             if secret:
-                id = self.getIDBySecret(secret)
+                wish = self.getWishBySecret(secret)
             elif not id:
                 raise AttributeError("Need to give wish id or secret!")
             else:
                 wish = self.__dbCallGetWishById(id)
 
             wish.delete()
-            db.session.commit()
+            self.__commitChange("deleted", wish)
+        return wish
 
     def undelWish(self, id="", secret=""):
-        with app.app_context():
+        with self.__session():
             if secret:
-                id = self.getIDBySecret(secret)
+                wish = self.getWishBySecret(secret)
             elif not id:
                 raise AttributeError("Need to give wish id or secret!")
             else:
                 wish = self.__dbCallGetWishById(id)
 
+            previous = {"deleted": wish.deleted.isoformat() if wish.deleted else None}
             wish.undelete()
-            db.session.commit()
+            self.__commitChange("restored", wish, previous)
+        return wish
 
-    def getPriorityOrderedWishes(self, giftedWishSecrets=[]):
-        with app.app_context():
-            wishes = db.session.scalars(
-                select(Wish)
-                .where(Wish.deleted == None)
-                .order_by(
-                    (Wish.giver == "").desc(),
-                    (Wish.secret.in_(giftedWishSecrets)).desc(),
-                    Wish.priority.desc(),
-                )
-            ).all()
-        return wishes
+    def iterPriorityOrderedWishes(self, giftedWishSecrets=[], batchSize: int = 1000):
+        """
+        Wishes by priority, fetched lazily in batches. Open and fulfilled wishes
+        come in index order, only the visitor's own gifts are looked up and
+        moved up front separately.
 
-    def getPriorityOrderedWishesNoSpoiler(self, giftedWishSecrets=[]):
-        with app.app_context():
-            wishes = db.session.scalars(
-                select(Wish)
-                .where(Wish.deleted == None)
-                .order_by(
-                    (Wish.secret.in_(giftedWishSecrets)),
-                    Wish.priority.desc(),
-                )
-            ).all()
-        return wishes
+        Yields:
+            open wishes, then wishes fulfilled by the visitor, then all other fulfilled wishes
+        """
+        yield from self.__iterByStatus(STATUS_OPEN, batchSize)
+        gifted = self.__getGiftedWishes(giftedWishSecrets)
+        yield from gifted
+        giftedIDs = {wish.id for wish in gifted}
+        for wish in self.__iterByStatus(STATUS_FULFILLED, batchSize):
+            if wish.id not in giftedIDs:
+                yield wish
 
-    def getDeletedWishes(self):
-        with app.app_context():
+    def iterPriorityOrderedWishesNoSpoiler(self, giftedWishSecrets=[], batchSize: int = 1000):
+        """
+        Wishes by priority without telling which are fulfilled, fetched lazily
+        in batches.
+
+        Yields:
+            all wishes not fulfilled by the visitor, then those fulfilled by the visitor
+        """
+        gifted = self.__getGiftedWishes(giftedWishSecrets)
+        giftedIDs = {wish.id for wish in gifted}
+        # Both statuses come ordered from the index, so merging keeps the order
+        yield from (
+            wish
+            for wish in merge(
+                self.__iterByStatus(STATUS_OPEN, batchSize),
+                self.__iterByStatus(STATUS_FULFILLED, batchSize),
+                key=_priorityOrder,
+            )
+            if wish.id not in giftedIDs
+        )
+        yield from gifted
+
+    def getDeletedWishes(self, limit: int | None = None, before: int | None = None):
+        """
+        Get deleted wishes, most recently deleted first.
+
+        Args:
+            limit (int, optional): maximum number of wishes to return. Defaults to None, all of them.
+            before (int, optional): ID of a deleted wish, only return the ones deleted before it.
+                Defaults to None, start with the most recently deleted one. So does an
+                ID that isn't a deleted wish of this list (any more), e.g. an old link
+                to a wish that was restored or archived since.
+
+        Returns:
+            list of deleted wishes
+        """
+        with self.__session():
+            query = select(Wish).where(self.__inList() & (Wish.status == STATUS_DELETED))
+            cursor = None
+            if before is not None:
+                cursor = db.session.scalars(query.where(Wish.id == before)).first()
+            if cursor is not None:
+                query = query.where(
+                    tuple_(Wish.deleted, Wish.id) < tuple_(cursor.deleted, cursor.id)
+                )
             wishes = db.session.scalars(
-                select(Wish).where(Wish.deleted != None).order_by(Wish.deleted.desc())
+                query.order_by(Wish.deleted.desc(), Wish.id.desc()).limit(limit)
             ).all()
         return wishes
 
-    def getStats(self):
-        with app.app_context():
-            stats = {}
-            stats["count"] = db.session.query(Wish).filter(Wish.deleted == None).count()
-            stats["fulfilled"] = (
-                db.session.query(Wish)
-                .filter((Wish.deleted == None) & (Wish.giver != ""))
-                .count()
-            )
-            stats["endless"] = (
-                db.session.query(Wish)
-                .filter((Wish.deleted == None) & (Wish.endless == True))
-                .count()
-            )
-            stats["nrDeleted"] = (
-                db.session.query(Wish).filter(Wish.deleted != None).count()
+    def getAdminSnapshot(self):
+        """
+        The active wishes and stats the admin page shows, read in one pass over
+        the list's open and fulfilled wishes. The snapshot holds WishViews, not
+        wishes bound to a session, and is kept until the wishlist version changes.
+        Deleted wishes are not part of it, the admin page reads them a page at a
+        time with getDeletedWishes.
+
+        Returns:
+            AdminSnapshot with the active wishes and the stats
+        """
+        cached = self.__adminSnapshot
+        with self.__session():
+            version = self.version
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+            activeWishes = []
+            stats = {"count": 0, "fulfilled": 0, "endless": 0, "nrDeleted": 0}
+            for wish in self.iterPriorityOrderedWishesNoSpoiler():
+                activeWishes.append(WishView(wish))
+                if wish.giver != "":
+                    stats["fulfilled"] += 1
+                if wish.endless:
+                    stats["endless"] += 1
+            stats["count"] = len(activeWishes)
+            stats["nrDeleted"] = db.session.scalar(
+                select(func.count())
+                .select_from(Wish)
+                .where(self.__inList() & (Wish.status == STATUS_DELETED))
             )
+
+            snapshot = AdminSnapshot(activeWishes, stats)
+            # Not kept if the list changed while it was read
+            if self.version == version:
+                self.__adminSnapshot = (version, snapshot)
+        return snapshot
+
+    def getStats(self):
+        active = Wish.deleted == None
+        with self.__session():
+            row = db.session.execute(
+                select(
+                    func.coalesce(func.sum(case((active, 1), else_=0)), 0),
+                    func.coalesce(
+                        func.sum(case((active & (Wish.giver != ""), 1), else_=0)), 0
+                    ),
+                    func.coalesce(
+                        func.sum(case((active & (Wish.endless == True), 1), else_=0)),
+                        0,
+                    ),
+                    func.coalesce(func.sum(case((active, 0), else_=1)), 0),
+                ).where(self.__inList())
+            ).one()
+        stats = {}
+        stats["count"], stats["fulfilled"], stats["endless"], stats["nrDeleted"] = row
         return stats
 
+    def search(self, text: str, limit: int = 50):
+        """
+        Full-text search over the titles and descriptions of the active wishes.
+        Every word has to match the start of a word, so any of them may be
+        incomplete. Matches in the title rank higher than matches in the
+        description.
+
+        Args:
+            text (str): what the visitor searched for
+            limit (int, optional): maximum number of results. Defaults to 50.
+
+        Returns:
+            list of matching wishes, best match first
+        """
+        words = SEARCH_WORD_PATTERN.findall(text)
+        if not words:
+            return []
+
+        query = select(Wish).where(self.__inList() & (Wish.deleted == None)).limit(limit)
+        with self.__session():
+            if db.engine.dialect.name == "sqlite":
+                # FTS5 takes the table name as the column to match against
+                searchIndex = literal_column(SEARCH_INDEX.name)
+                query = (
+                    query.join(SEARCH_INDEX, SEARCH_INDEX.c.rowid == Wish.id)
+                    .where(searchIndex.match(" ".join(f'"{word}"*' for word in words)))
+                    .order_by(func.bm25(searchIndex, SEARCH_TITLE_WEIGHT, 1.0))
+                )
+            else:
+                # No search index outside of SQLite, fall back to scanning the table
+                for word in words:
+                    query = query.where(
+                        Wish.title.icontains(word, autoescape=True)
+                        | Wish.desc.icontains(word, autoescape=True)
+                    )
+                query = query.order_by(Wish.priority.desc(), Wish.id)
+            return db.session.scalars(query).all()
+
+    def getFulfilledSecrets(self, secrets: Iterable[str]):
+        """
+        Args:
+            secrets (Iterable[str]): secrets of wishes a visitor fulfilled
+
+        Returns:
+            set of the given secrets that still belong to a wish. Reopening a wish
+            clears its secret and archiving removes it, deleted wishes keep theirs
+            as they can be restored.
+        """
+        with self.__session():
+            return set(
+                db.session.scalars(
+                    select(Wish.secret).where(self.__inList() & Wish.secret.in_(secrets))
+                )
+            )
+
     def getWishByID(self, id):
-        with app.app_context():
+        with self.__session():
             wish = self.__dbCallGetWishById(id)
         return wish
 
+    def getWishesByIDs(self, ids: Iterable, includeDeleted: bool = False):
+        """
+        Get several wishes with one query.
+
+        Args:
+            ids (Iterable): IDs of the wishes
+            includeDeleted (bool, optional): also return deleted wishes. Defaults to False.
+
+        Raises:
+            WishNotFoundError: Is raised if an ID is not a number.
+
+        Returns:
+            the wishes that exist, in the order of their IDs in ids
+        """
+        ids = [self.__toWishID(id) for id in ids]
+        condition = self.__inList() & Wish.id.in_(ids)
+        if not includeDeleted:
+            condition &= Wish.deleted == None
+        with self.__session():
+            wishesByID = {wish.id: wish for wish in db.session.scalars(select(Wish).where(condition))}
+        return [wishesByID[id] for id in dict.fromkeys(ids) if id in wishesByID]
+
+    def applyBatch(self, operations: list[dict]):
+        """
+        Fulfill, reopen or delete several wishes in one transaction. Either all
+        operations succeed or none does. Deleted wishes can't be fulfilled,
+        reopened or deleted again.
+
+        Args:
+            operations (list[dict]): each with the "action" (one of BATCH_ACTIONS)
+                and the "id" of the wish, fulfill also needs the "giver"
+
+        Raises:
+            BatchOperationError: Is raised if an operation fails, with the
+                index of the operation and the error.
+
+        Returns:
+            the changed wishes, in the order of the operations
+        """
+        with self.__session():
+            try:
+                # Invalid IDs are reported with the index of their operation below
+                ids = [operation.get("id") for operation in operations]
+                wishesByID = {
+                    wish.id: wish
+                    for wish in self.getWishesByIDs(
+                        [id for id in ids if str(id).isdigit()], includeDeleted=True
+                    )
+                }
+                changed = []
+                for index, operation in enumerate(operations):
+                    try:
+                        changed.append(self.__applyOperation(operation, wishesByID))
+                    except ValueError as e:
+                        raise BatchOperationError(index, e) from e
+            except BaseException:
+                db.session.rollback()
+                raise
+            self.__commitChange("batch")
+        return changed
+
+    def archiveDeleted(self, deletedBefore: datetime, batchSize: int = 500):
+        """
+        Move wishes deleted before a time to the wishes_archive table, one
+        batch per call. Each batch is a short transaction of its own, so
+        visitors fulfilling wishes don't have to wait for the whole archival.
+
+        Args:
+            deletedBefore (datetime): archive wishes deleted before this time
+            batchSize (int, optional): maximum number of wishes to archive. Defaults to 500.
+
+        Returns:
+            number of archived wishes, 0 once there are none left
+        """
+        with self.__session():
+            wishes = db.session.scalars(
+                select(Wish)
+                .where(
+                    self.__inList()
+                    & (Wish.status == STATUS_DELETED)
+                    & (Wish.deleted < deletedBefore)
+                )
+                .order_by(Wish.id)
+                .limit(batchSize)
+            ).all()
+            if not wishes:
+                return 0
+            archived = datetime.now()
+            db.session.execute(
+                insert(ArchivedWish),
+                [
+                    wish.toDict() | {"listSlug": self.listSlug, "archived": archived}
+                    for wish in wishes
+                ],
+            )
+            for wish in wishes:
+                self.__recordChange("archived", wish)
+                db.session.delete(wish)
+            self.__commitChange("archived")
+        return len(wishes)
+
     def getWishBySecret(self, secret):
-        with app.app_context():
-            wish = db.session.scalars(select(Wish).where(Wish.secret == secret)).first()
+        with self.__session():
+            wish = db.session.scalars(
+                select(Wish).where(self.__inList() & (Wish.secret == secret))
+            ).first()
             if wish == None:
                 raise WishNotFoundError(wishId=secret)
         return wish
@@ -156,20 +575,249 @@ class Wishlist:
         return id
 
     def markFulfilled(self, id, giver):
-        with app.app_context():
-            wish = self.__dbCallGetWishById(id)
-            wish.markFulfilled(giver)
-            db.session.commit()
+        """
+        Mark an open wish as fulfilled in a single conditional UPDATE,
+        so two visitors can never both claim the same wish.
+
+        Args:
+            id (int): ID of the wish
+            giver (str): Name of person gifting the thing
 
-    def reopenWish(self, id):
-        with app.app_context():
+        Raises:
+            ValueError: Is raised if the giver is empty, the wish would count as fulfilled but show as open.
+            WishNotFoundError: Is raised if there is no wish with that ID or it is deleted.
+            WishEndlessError: Is raised if the wish is endless and can't be fulfilled.
+            WishFulfilledError: Is raised if someone else fulfilled the wish first.
+
+        Returns:
+            the fulfilled wish, with the secret to reopen it with
+        """
+        giver = giver.strip()
+        if not giver:
+            raise ValueError("Giver must not be empty.")
+        with self.__session():
+            wish = db.session.scalars(
+                update(Wish)
+                .where(
+                    (Wish.id == id)
+                    & self.__inList()
+                    & (Wish.status == STATUS_OPEN)
+                    & (Wish.endless == False)
+                )
+                .values(giver=giver, secret=uuid4().hex, status=STATUS_FULFILLED)
+                .returning(Wish)
+            ).one_or_none()
+            if wish is None:
+                db.session.rollback()
+                # Nothing was updated, find out why
+                wish = self.__dbCallGetWishById(id)
+                if wish.deleted is not None:
+                    raise WishNotFoundError(wishId=id)
+                if wish.endless:
+                    raise WishEndlessError()
+                raise WishFulfilledError()
+            self.__commitChange("fulfilled", wish)
+        return wish
+
+    def reopenWish(self, id, secret: str | None = None):
+        """
+        Args:
+            id (int): ID of the wish
+            secret (str, optional): if given, it has to match the wish's secret. Defaults to None.
+
+        Raises:
+            WishNotFoundError: Is raised if there is no wish with that ID.
+            SecretMismatchError: Is raised if the secret doesn't match the wish's secret.
+
+        Returns:
+            the reopened wish
+        """
+        with self.__session():
             wish = self.__dbCallGetWishById(id)
+            if secret is not None and wish.secret != secret:
+                raise SecretMismatchError()
+            previous = {"giver": wish.giver}
             wish.reopen()
-            db.session.commit()
+            self.__commitChange("reopened", wish, previous)
+        return wish
+
+    @contextmanager
+    def __session(self):
+        """
+        Run db calls in the current app context, so all Wishlist calls while
+        handling one request share a session and its identity map, and wishes
+        loaded once aren't fetched again. Outside of an app context (scripts,
+        tests) a short one is pushed for the call.
+
+        pysqlite doesn't begin a transaction for reads, so each query sees the
+        latest commit, also within one request. Whatever is cached against the
+        version has to check that it didn't change while reading.
+
+        Yields:
+            the session to use
+        """
+        if has_app_context():
+            yield db.session
+        elif self.app is not None:
+            with self.app.app_context():
+                yield db.session
+        else:
+            raise RuntimeError("Wishlist needs an app context or an app to create one.")
+
+    def __flushBatch(self, batch):
+        if not batch:
+            return
+        db.session.add_all(batch)
+        db.session.flush()
+        db.session.execute(
+            insert(WishChange),
+            [
+                {
+                    "listSlug": self.listSlug,
+                    "wishId": wish.id,
+                    "kind": "imported",
+                    "data": {"wish": _journalFields(wish)},
+                }
+                for wish in batch
+            ],
+        )
+        # Keep memory use bounded no matter how many wishes are imported
+        for wish in batch:
+            db.session.expunge(wish)
+
+    def __getGiftedWishes(self, giftedWishSecrets):
+        """
+        Returns:
+            the active fulfilled wishes with the given secrets, by descending priority
+        """
+        if not giftedWishSecrets:
+            return []
+        with self.__session():
+            wishes = db.session.scalars(
+                select(Wish).where(
+                    self.__inList()
+                    & (Wish.status == STATUS_FULFILLED)
+                    & Wish.secret.in_(giftedWishSecrets)
+                )
+            ).all()
+        return sorted(wishes, key=_priorityOrder)
+
+    def __iterByStatus(self, status: int, batchSize):
+        """
+        Yield the wishes with a status by descending priority, fetched in batches
+        with keyset pagination over (priority, id). The order comes straight
+        from ix_wishes_list_status_priority, so nothing has to be sorted. Every
+        batch sees the latest commit, so a wish whose status changes in between
+        can be skipped or come twice, see __session.
+
+        Args:
+            status (int): one of the STATUS_ values
+            batchSize (int): number of wishes to fetch per query
+
+        Yields:
+            the matching wishes
+        """
+        query = (
+            select(Wish)
+            .where(self.__inList() & (Wish.status == status))
+            .order_by(Wish.priority.desc(), Wish.id)
+            .limit(batchSize)
+        )
+        lastWish = None
+        while True:
+            batchQuery = query
+            if lastWish is not None:
+                batchQuery = query.where(
+                    (Wish.priority < lastWish.priority)
+                    | ((Wish.priority == lastWish.priority) & (Wish.id > lastWish.id))
+                )
+            with self.__session():
+                batch = db.session.scalars(batchQuery).all()
+            yield from batch
+            if len(batch) < batchSize:
+                return
+            lastWish = batch[-1]
+
+    def __inList(self):
+        return Wish.listSlug == self.listSlug
+
+    def __applyOperation(self, operation: dict, wishesByID: dict):
+        action = operation.get("action")
+        if action not in BATCH_ACTIONS:
+            raise ValueError(f"Unknown action {action!r}.")
+        wish = wishesByID.get(self.__toWishID(operation.get("id")))
+        if wish is None:
+            raise WishNotFoundError(wishId=operation.get("id"))
+
+        # Each operation is a conditional UPDATE like markFulfilled, so a change
+        # committed since the wishes were read is never overwritten
+        previous = None
+        if action == "fulfill":
+            giver = str(operation.get("giver") or "").strip()
+            if not giver:
+                raise ValueError("Giver must not be empty.")
+            condition = (Wish.status == STATUS_OPEN) & (Wish.endless == False)
+            values = {"giver": giver, "secret": uuid4().hex, "status": STATUS_FULFILLED}
+        elif action == "reopen":
+            previous = {"giver": wish.giver}
+            condition = (Wish.status != STATUS_DELETED) & (Wish.giver == wish.giver)
+            values = {"giver": "", "secret": None, "status": STATUS_OPEN}
+        else:
+            condition = Wish.status != STATUS_DELETED
+            values = {"deleted": datetime.now(), "status": STATUS_DELETED}
+
+        updated = db.session.scalars(
+            update(Wish)
+            .where((Wish.id == wish.id) & self.__inList() & condition)
+            .values(**values)
+            .returning(Wish)
+        ).one_or_none()
+        if updated is None:
+            # Nothing was updated, find out why
+            db.session.refresh(wish)
+            if wish.deleted is not None:
+                raise WishNotFoundError(wishId=wish.id)
+            if action == "fulfill" and wish.endless:
+                raise WishEndlessError()
+            raise WishFulfilledError()
+        self.__recordChange(BATCH_ACTIONS[action], updated, previous)
+        return updated
+
+    def __recordChange(self, kind: str, wish: "Wish", previous: dict | None = None):
+        data = {"wish": _journalFields(wish)}
+        if previous:
+            data["previous"] = previous
+        db.session.add(WishChange(listSlug=self.listSlug, wishId=wish.id, kind=kind, data=data))
+
+    def __commitChange(self, kind: str, wish: "Wish | None" = None, previous: dict | None = None):
+        """
+        Record a change in the wish_changes table and commit it together with
+        the change itself. Only works if called within the app.app_context().
+
+        Args:
+            kind (str): what happened, one of CHANGE_KINDS
+            wish (Wish, optional): the changed wish, None if the changes were
+                already recorded, like for an import
+            previous (dict, optional): the values of fields the change overwrote
+        """
+        if wish is not None:
+            self.__recordChange(kind, wish, previous)
+        db.session.commit()
+        wishlistChanged.send(self, kind=kind, wishId=wish.id if wish is not None else None)
+
+    @staticmethod
+    def __toWishID(id):
+        try:
+            return int(id)
+        except (TypeError, ValueError):
+            raise WishNotFoundError(wishId=id)
+
+    def __latestChangeID(self):
+        return db.session.scalar(select(func.max(WishChange.id))) or 0
 
     def __dbCallGetWishById(self, wishId):
         """
-        Get a wish from the db by it's ID.
+        Get a wish by it's ID, from the session's identity map if it was loaded before.
         Only works if called within the app.app_context().
 
         Args:
@@ -181,14 +829,129 @@ class Wishlist:
         Returns:
             wish with the given ID
         """
-        wish = db.session.scalars(select(Wish).where(Wish.id == wishId)).first()
-        if wish == None:
+        try:
+            wish = db.session.get(Wish, int(wishId))
+        except (TypeError, ValueError):
+            wish = None
+        if wish == None or wish.listSlug != self.listSlug:
             raise WishNotFoundError(wishId=wishId)
         return wish
 
 
+class WishChange(db.Model):
+    """
+    A committed change to a wishlist, the journal of all lists. Every process
+    reads new rows to learn about changes made by the others, see
+    changes.ChangeFeed. The ID is the version of the journal: SQLite commits
+    one writer at a time, so a higher ID is never visible before a lower one.
+    """
+
+    __tablename__ = "wish_changes"
+    __table_args__ = (Index("ix_wish_changes_list_id", "listSlug", "id"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    listSlug: Mapped[str]
+    # None for changes recorded before the journal kept one row per wish
+    wishId: Mapped[int | None] = mapped_column(nullable=True)
+    kind: Mapped[str]
+    created: Mapped[datetime] = mapped_column(default=datetime.now)
+    # The wish after the change and the field values it overwrote,
+    # None for changes recorded before the journal kept them
+    data: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+
+    def toDict(self):
+        return {
+            "version": self.id,
+            "kind": self.kind,
+            "wishId": self.wishId,
+            "created": self.created.isoformat(),
+            **(self.data or {}),
+        }
+
+
+class ArchivedWish(db.Model):
+    """A deleted wish moved out of the wishes table by maintenance.Maintenance."""
+
+    __tablename__ = "wishes_archive"
+
+    # The ID the wish had in the wishes table
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    listSlug: Mapped[str]
+    title: Mapped[str]
+    priority: Mapped[int]
+    desc: Mapped[str]
+    link: Mapped[str]
+    endless: Mapped[bool]
+    giver: Mapped[str]
+    secret: Mapped[str | None] = mapped_column(nullable=True)
+    deleted: Mapped[datetime]
+    archived: Mapped[datetime]
+
+
+class WishView:
+    """
+    What the templates need to know about a wish, computed once per render
+    instead of calling Wish methods several times per wish.
+    """
+
+    __slots__ = (
+        "id",
+        "title",
+        "priority",
+        "desc",
+        "link",
+        "linkDomain",
+        "endless",
+        "giver",
+        "secret",
+        "fulfilled",
+        "isMine",
+        "cacheKey",
+    )
+
+    def __init__(self, wish: "Wish", giftedWishSecrets=frozenset()):
+        """
+        Args:
+            wish (Wish): the wish to show
+            giftedWishSecrets (frozenset, optional): secrets of the wishes the visitor fulfilled
+        """
+        self.id = wish.id
+        self.title = wish.title
+        self.priority = wish.priority
+        self.desc = wish.desc
+        self.link = wish.link
+        self.linkDomain = _getLinkDomain(wish.link) if wish.link else ""
+        self.endless = wish.endless
+        self.giver = wish.giver
+        self.secret = wish.secret
+        self.fulfilled = wish.giver != ""
+        self.isMine = wish.secret is not None and wish.secret in giftedWishSecrets
+        # Everything a rendered wish depends on, so it changes whenever the wish does
+        self.cacheKey = (
+            self.id,
+            self.title,
+            self.desc,
+            self.link,
+            self.endless,
+            self.giver,
+            self.isMine,
+            self.secret if self.isMine else None,
+        )
+
+
+class AdminSnapshot(NamedTuple):
+    # WishViews of the active wishes by descending priority
+    activeWishes: list
+    stats: dict
+
+
 class Wish(db.Model):
     __tablename__ = "wishes"
+    __table_args__ = (
+        Index("ix_wishes_secret", "secret", unique=True),
+        # IDs of archived wishes must not be handed out again
+        {"sqlite_autoincrement": True},
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str]
@@ -197,8 +960,12 @@ class Wish(db.Model):
     link: Mapped[str]
     endless: Mapped[bool]
     giver: Mapped[str]
-    secret: Mapped[str]  # = mapped_column(unique=True)
+    # None while the wish is open, so the unique index only covers given secrets
+    secret: Mapped[str | None] = mapped_column(nullable=True)
     deleted: Mapped[datetime | None] = mapped_column(nullable=True)
+    listSlug: Mapped[str] = mapped_column(server_default="")
+    # One of the STATUS_ values, follows giver and deleted
+    status: Mapped[int] = mapped_column(server_default="0")
 
     def __init__(
         self,
@@ -210,6 +977,7 @@ class Wish(db.Model):
         giver: str = "",
         secret: str = "",
         deleted: datetime | None = None,
+        listSlug: str = "",
     ):
         """
         Args:
@@ -221,6 +989,7 @@ class Wish(db.Model):
             giver (str, optional): Name of person gifting the thing. If empty, then wish still open. Defaults to ''.
             secret (str, optional): secret of link to mark wish as open again. Defaults to ''.
             deleted (datetime, optional): If not none: time at which the wish was deleted (None if wish is not deleted)
+            listSlug (str, optional): the list the wish is on. Defaults to '', the default list.
         """
         if len(title.strip()) == 0:
             raise ValueError("Title must not be empty.")
@@ -232,31 +1001,43 @@ class Wish(db.Model):
         self.link = link
         self.endless = endless
         self.giver = giver
-        self.secret = secret
+        self.secret = secret or None
         self.deleted = deleted
+        self.listSlug = listSlug
+        self.updateStatus()
 
-    def getLinkDomain(self):
-        parsedLink = urlparse(self.link)
-        domain = parsedLink.netloc
+    def updateStatus(self):
+        """Bring the status in line with the giver and deletion time."""
+        if self.deleted is not None:
+            self.status = STATUS_DELETED
+        elif self.giver != "":
+            self.status = STATUS_FULFILLED
+        else:
+            self.status = STATUS_OPEN
 
-        # Remove any leading "www." from the domain
-        if domain.startswith("www."):
-            domain = domain[4:]
+    def toDict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "priority": self.priority,
+            "desc": self.desc,
+            "link": self.link,
+            "endless": self.endless,
+            "giver": self.giver,
+            "secret": self.secret,
+            "deleted": self.deleted,
+        }
 
-        return domain
+    def getLinkDomain(self):
+        return _getLinkDomain(self.link)
 
     def isFulfilled(self):
         return self.giver != ""
 
-    def markFulfilled(self, giver: str):
-        if self.isFulfilled():
-            raise WishFulfilledError()
-        self.giver = giver
-        self.secret = uuid4().hex
-
     def reopen(self):
         self.giver = ""
-        self.secret = ""
+        self.secret = None
+        self.updateStatus()
 
     def hasMatchingSecretIn(self, secrets):
         return self.secret in secrets
@@ -264,9 +1045,49 @@ class Wish(db.Model):
     def delete(self):
         if self.deleted == None:
             self.deleted = datetime.now()
+        self.updateStatus()
 
     def undelete(self):
         self.deleted = None
+        self.updateStatus()
+
+
+def _journalFields(wish: "Wish"):
+    """
+    The fields of a wish as kept in the change journal. Leaves out the secret,
+    as it lets anyone who knows it reopen the wish.
+    """
+    fields = wish.toDict()
+    del fields["secret"]
+    if fields["deleted"] is not None:
+        fields["deleted"] = fields["deleted"].isoformat()
+    return fields
+
+
+# Lets the database read list pages in order instead of sorting all wishes
+Index(
+    "ix_wishes_list_status_priority",
+    Wish.listSlug,
+    Wish.status,
+    Wish.priority.desc(),
+    Wish.id,
+)
+
+
+def _priorityOrder(wish: "Wish"):
+    return (-wish.priority, wish.id)
+
+
+@lru_cache(maxsize=4096)
+def _getLinkDomain(link: str):
+    parsedLink = urlparse(link)
+    domain = parsedLink.netloc
+
+    # Remove any leading "www." from the domain
+    if domain.startswith("www."):
+        domain = domain[4:]
+
+    return domain
 
 
 class WishNotFoundError(ValueError):
@@ -292,3 +1113,29 @@ class WishFulfilledError(ValueError):
 
     def __str__(self):
         return f"The wish is already fulfilled!"
+
+
+class WishEndlessError(ValueError):
+    def __init__(self, *args):
+        super().__init__(args)
+
+    def __str__(self):
+        return f"The wish is endless and can not be fulfilled!"
+
+
+class ChangesExpiredError(ValueError):
+    def __init__(self, *args):
+        super().__init__(args)
+
+    def __str__(self):
+        return f"The changes since this version are no longer in the journal!"
+
+
+class BatchOperationError(ValueError):
+    def __init__(self, index: int, error: ValueError, *args):
+        super().__init__(args)
+        self.index = index
+        self.error = error
+
+    def __str__(self):
+        return f"Operation {self.index}: {self.error}"